@@ -1,96 +1,40 @@
 import streamlit as st
-import json
+import copy
 import os
-import google.generativeai as genai
-from PIL import Image
-from gtts import gTTS
-import io
 import re
-import gspread
 import threading
 import time
-import requests
-from duckduckgo_search import DDGS
+from functools import partial
+from perf_tracer import TRACER, span, traced
+from sheets_quota import QUOTA, INTERACTIVE, BACKGROUND, is_retryable_error, open_workbook
+from student_cache import STUDENTS, STUDENT_FIELDS, StaleWriteError
+from audio_prep import audio_fingerprint, preprocess_voice, describe_savings
+from media_cache import ImageSearchUnavailable, cached_image_url, cached_speech, clean_text_for_speech, fetch_display_image, welcome_message, IMAGE_BYTES_MEMORY
+from syllabus import SYLLABUS_WORKSHEET, curriculum_from_records
+from bulk_marking import BulkMarkingJob, split_scripts, write_results
+from cohort import OTHER_COURSE, cohort_report
+
+# NOTE: google.generativeai, gspread, gtts, duckduckgo_search, requests and PIL
+# are imported lazily where they are first used. Importing them all up front
+# used to cost several seconds before the name prompt could even be painted.
+
+# Every Streamlit run is one "turn" for the performance panel
+TRACER.begin_turn()
 
 # --- NEW: HYBRID IMAGE ENGINE WITH WIKIPEDIA ARTICLE API ---
+@traced("fetch_web_image")
 def fetch_web_image(search_query):
-    """Tries DuckDuckGo first. If blocked, searches Wikipedia articles for their main thumbnail."""
-    
-    # STEP 1: Try DuckDuckGo
+    """Cached DuckDuckGo/Wikipedia lookup (see media_cache.py). Live search steps stream into the caller's st.status box."""
     try:
-        st.write(f"🦆 **DuckDuckGo:** Searching for `[{search_query}]`...")
-        results = DDGS().images(search_query, max_results=3, safesearch='Moderate')
-        if not results:
-             st.write("⚠️ *DuckDuckGo returned 0 results. (Likely a bot-block)*")
-        if results and len(results) > 0:
-            st.write(f"✅ *DuckDuckGo found {len(results)} images!*")
-            for r in results:
-                if r.get('image'): return r.get('image')
-                
-        # If the search was too long, try shortening it for DDG
-        words = search_query.split()
-        if len(words) > 2:
-            short_query = " ".join(words[:2])
-            st.write(f"✂️ **DuckDuckGo Fallback:** Chopping query to `[{short_query}]`...")
-            short_results = DDGS().images(short_query, max_results=3)
-            if not short_results:
-                 st.write("⚠️ *DuckDuckGo fallback returned 0 results.*")
-            if short_results and len(short_results) > 0:
-                st.write(f"✅ *DuckDuckGo fallback found images!*")
-                for r in short_results:
-                    if r.get('image'): return r.get('image')
-    except Exception as e:
-        st.write(f"🛑 *DuckDuckGo Crash Error: {e}*")
-        
-    # STEP 2: Fallback to Wikipedia Article Images (Highly reliable)
-    def ask_wikipedia(query):
-        try:
-            st.write(f"🌍 **Wikipedia:** Searching for article about `[{query}]`...")
-            url = "https://en.wikipedia.org/w/api.php"
-            params = {
-                "action": "query",
-                "format": "json",
-                "generator": "search",
-                "gsrsearch": query,
-                "gsrlimit": 3,
-                "prop": "pageimages",
-                "pithumbsize": 800
-            }
-            headers = {
-                "User-Agent": "ChristineAITutor/1.0 (Educational App)"
-            }
-            response = requests.get(url, params=params, headers=headers, timeout=5).json()
-            pages = response.get("query", {}).get("pages", {})
-            
-            if not pages:
-                 st.write("⚠️ *Wikipedia returned 0 matching articles.*")
-                 return None
-                 
-            for page_id, page_data in pages.items():
-                if "thumbnail" in page_data:
-                    img_url = page_data["thumbnail"].get("source")
-                    title = page_data.get('title', 'Unknown')
-                    st.write(f"✅ *Wikipedia found an image from the article: '{title}'!*")
-                    return img_url
-            
-            st.write("⚠️ *Wikipedia found the article, but it has no main image.*")
-        except Exception as e:
-            st.write(f"🛑 *Wikipedia API Error: {e}*")
+        return cached_image_url(search_query, log=st.write)
+    except ImageSearchUnavailable:
+        # The errors were already written into the status box; try again next time
         return None
 
-    # Try full query
-    wiki_img = ask_wikipedia(search_query)
-    if wiki_img: return wiki_img
-    
-    # Try just the core noun (first word)
-    words = search_query.split()
-    if len(words) > 1:
-        short_wiki_query = words[0]
-        st.write(f"✂️ **Wikipedia Fallback:** Chopping query to single word `[{short_wiki_query}]`...")
-        short_wiki_img = ask_wikipedia(short_wiki_query)
-        if short_wiki_img: return short_wiki_img
-
-    return None
+@traced("fetch_display_image")
+def load_display_image(image_url):
+    """Downloads, verifies and resizes the image on the server; returns bytes for st.image or None."""
+    return fetch_display_image(image_url, log=st.write)
 
 # --- NEW: AQA RUBRIC LOADER ---
 @st.cache_data
@@ -108,92 +52,167 @@ def load_aqa_rubric(file_path="aqa_master_rubric.txt"):
     else:
         return "🔴 Missing", f"File '{file_path}' not found.", False
 
-# --- GOOGLE SHEETS ENGINE ---
+# --- GOOGLE SHEETS ENGINE (BACKGROUND CONNECTION) ---
+SYLLABUS_MAX_AGE = 300
+
+class SheetsConnection:
+    """Opens the workbook on a daemon thread so the first page paint never waits on Google.
+    Callers block in wait() only if they need a sheet before the handshake has finished."""
+
+    def __init__(self, creds_json):
+        self._ready = threading.Event()
+        self._lock = threading.Lock()
+        self.workbook = None
+        self.sheet = None
+        self.syllabus_sheet = None
+        self.error = None
+        self.syllabus_records = None
+        self.syllabus_fetched_at = 0.0
+        threading.Thread(target=self._connect, args=(creds_json,), daemon=True).start()
+
+    def _connect(self, creds_json):
+        try:
+            with span("connect_to_sheets"):
+                workbook = open_workbook(creds_json)
+                self.workbook = workbook
+                # Both look up sheet metadata, so they spend quota like any other request
+                self.sheet = QUOTA.call(workbook.get_worksheet, 0)
+                self.syllabus_sheet = QUOTA.call(workbook.worksheet, SYLLABUS_WORKSHEET)
+            # Prefetch the syllabus while the student is still typing their name (a student who needs it lifts the read)
+            self.get_syllabus_records(priority=BACKGROUND)
+        except Exception as e:
+            self.error = e
+            print(f"Sheets background connection failed: {e}")
+        finally:
+            self._ready.set()
+
+    def failed(self):
+        return self._ready.is_set() and self.sheet is None
+
+    def wait(self, timeout=30):
+        if not self._ready.wait(timeout):
+            raise TimeoutError("Google Sheets connection is still opening.")
+        if self.sheet is None:
+            raise self.error or RuntimeError("Google Sheets connection failed.")
+        return self
+
+    def get_syllabus_records(self, max_age=SYLLABUS_MAX_AGE, priority=INTERACTIVE):
+        with self._lock:
+            if self.syllabus_records is not None and time.time() - self.syllabus_fetched_at < max_age:
+                return self.syllabus_records
+        records = QUOTA.call(self.syllabus_sheet.get_all_records, priority=priority, coalesce_key="syllabus:get_all_records")
+        with self._lock:
+            self.syllabus_records = records
+            self.syllabus_fetched_at = time.time()
+        return records
+
 @st.cache_resource
 def connect_to_sheets():
-    creds_dict = json.loads(st.secrets["GOOGLE_CREDENTIALS"])
-    gc = gspread.service_account_from_dict(creds_dict)
-    return gc.open("Christine Student Memory")
+    return SheetsConnection(st.secrets["GOOGLE_CREDENTIALS"])
 
 try:
-    workbook = connect_to_sheets()
-    sheet = workbook.sheet1
-    syllabus_sheet = workbook.worksheet("Syllabus")
+    sheets_conn = connect_to_sheets()
+    if sheets_conn.failed():
+        # Don't keep a dead connection cached for the life of the process
+        connect_to_sheets.clear()
+        sheets_conn = connect_to_sheets()
 except Exception as e:
+    sheets_conn = None
     st.error(f"Could not connect to Google Sheets. Check your exact spreadsheet name: {e}")
 
+def get_student_sheet():
+    return sheets_conn.wait().sheet
+
 # --- SYLLABUS LOADER ---
 def load_syllabus():
     try:
-        records = syllabus_sheet.get_all_records()
-        curriculum = {}
-        for row in records:
-            course = str(row.get("Course", "")).strip()
-            topic = str(row.get("Topic", "")).strip()
-            if course and topic:
-                if course not in curriculum:
-                    curriculum[course] = []
-                curriculum[course].append(topic)
-        return curriculum
+        return curriculum_from_records(sheets_conn.wait().get_syllabus_records())
     except Exception:
         return {"General Study": ["General Topic"]}
 
-def load_data():
-    db = {}
+def fetch_student_rows(priority=INTERACTIVE):
+    sheet = get_student_sheet()
+    return QUOTA.call(sheet.get_all_values, priority=priority, coalesce_key="students:get_all_values")
+
+@traced("load_student")
+def load_student(name, priority=INTERACTIVE):
+    """Returns (record copy, version) for one student, or (None, 0) if they are new."""
+    STUDENTS.ensure_loaded(lambda: fetch_student_rows(priority))
+    return STUDENTS.snapshot(name)
+
+# --- PROFILE PREFETCH (WHILE THE NAME IS BEING TYPED) ---
+def start_profile_prefetch():
+    """Warms the shared student cache on a background thread. The returned Event is set
+    when it is done, so it is safe to keep in session_state and wait on later."""
+    ready = threading.Event()
+
+    def worker():
+        try:
+            with span("profile_prefetch"):
+                # Background lane: a student who logs in meanwhile joins the read and lifts it
+                STUDENTS.ensure_loaded(partial(fetch_student_rows, BACKGROUND))
+        except Exception as e:
+            print(f"Profile prefetch failed: {e}")
+        finally:
+            ready.set()
+
+    threading.Thread(target=worker, daemon=True).start()
+    return ready
+
+# --- STUDENT WRITES (COMPARE-AND-SWAP, CHANGED FIELDS ONLY) ---
+STUDENT_COLUMNS = dict(zip(STUDENT_FIELDS, ["B", "C", "D", "E", "F"]))
+
+def find_student_row(sheet, name, priority):
     try:
-        rows = sheet.get_all_values()
-        if len(rows) <= 1:
-            return db
-        
-        for row in rows[1:]:
-            while len(row) < 6:
-                row.append("")
-                
-            name_col = str(row[0]).strip().lower()
-            summary_col = str(row[1]).strip()
-            history_col = str(row[2]).strip()
-            age_col = str(row[3]).strip()
-            topic_col = str(row[4]).strip()
-            vault_col = str(row[5]).strip() 
-            
-            if name_col:
-                try:
-                    hist = json.loads(history_col)
-                except:
-                    hist = []
-                    
-                student_age = None if (age_col == "" or age_col == "0") else age_col
-                
-                db[name_col] = {
-                    "summary": summary_col, 
-                    "history": hist, 
-                    "age": student_age, 
-                    "last_topic": topic_col,
-                    "file_vault": vault_col 
-                }
-        return db
+        cell = QUOTA.call(sheet.find, name, in_column=1, priority=priority)
     except Exception as e:
-        st.error(f"⚠️ Database connection paused. Please refresh the page. (System code: {e})")
-        st.stop() 
-
-def save_current_student(name, data):
-    summary = data.get("summary", "")
-    full_history = data.get("history", [])
-    recent_history = full_history[-10:] if len(full_history) > 10 else full_history
-    hist_str = json.dumps(recent_history)
-    age = data.get("age", "") 
-    last_topic = data.get("last_topic", "")
-    file_vault = data.get("file_vault", "") 
-    
+        # Older gspread raises CellNotFound for a missing name. A quota error must
+        # NOT be mistaken for "missing", or the student ends up with a duplicate row.
+        if is_retryable_error(e):
+            raise
+        cell = None
+    return cell.row if cell else None
+
+@traced("save_current_student")
+def save_current_student(name, data, priority=INTERACTIVE, base=None, base_version=0):
+    """Saves the fields that differ from base, provided nobody else changed them since base_version.
+    Returns (new_version, fields other writers changed). Raises StaleWriteError on a real conflict."""
+    sheet = get_student_sheet()
+
+    def write_fields(student, values):
+        row = find_student_row(sheet, student, priority)
+        if row is None:
+            raise RuntimeError(f"Student '{student}' is cached but missing from the sheet.")
+        updates = [{"range": f"{STUDENT_COLUMNS[f]}{row}", "values": [[v]]} for f, v in values.items()]
+        QUOTA.call(sheet.batch_update, updates, value_input_option="USER_ENTERED", priority=priority)
+
+    def append_student(student, values):
+        # The row may exist already if it was added after the cache last loaded
+        row = find_student_row(sheet, student, priority)
+        if row is None:
+            QUOTA.call(sheet.append_row, [student] + values, priority=priority, idempotent=False)
+        else:
+            QUOTA.call(sheet.update, range_name=f"B{row}:F{row}", values=[values],
+                       value_input_option="USER_ENTERED", priority=priority)
+
+    return STUDENTS.commit(name, base, base_version, data, write_fields, append_student)
+
+def save_session_profile(name, user_data):
+    """Saves this tab's profile against the version the tab last saw, then folds in
+    anything other tabs or timers saved meanwhile."""
     try:
-        cell = sheet.find(name, in_column=1)
-        sheet.update_cell(cell.row, 2, summary)
-        sheet.update_cell(cell.row, 3, hist_str)
-        sheet.update_cell(cell.row, 4, age)
-        sheet.update_cell(cell.row, 5, last_topic)
-        sheet.update_cell(cell.row, 6, file_vault)
-    except Exception:
-        sheet.append_row([name, summary, hist_str, age, last_topic, file_vault])
+        version, others = save_current_student(
+            name, user_data,
+            base=st.session_state.get("user_base"),
+            base_version=st.session_state.get("user_version", 0),
+        )
+        user_data.update(others)
+    except StaleWriteError as e:
+        st.warning("Your profile was updated in another tab, so Christine loaded the newest copy. Your last change here was not saved.")
+        version = e.version
+        user_data.update(e.latest)
+    st.session_state.user_base = copy.deepcopy(user_data)
+    st.session_state.user_version = version
 
 # --- CONFIGURATION ---
 st.set_page_config(page_title="Christine AI Tutor", page_icon="🎓", layout="wide")
@@ -201,38 +220,34 @@ st.set_page_config(page_title="Christine AI Tutor", page_icon="🎓", layout="wi
 PRIMARY_MODEL = "gemini-2.5-flash"
 FALLBACK_MODEL = "gemini-2.5-flash-lite"
 
+AQA_REVIEW_PROMPT = "SYSTEM OVERRIDE: Act as a strict AQA Examiner. Do NOT rewrite the essay. Tell me which AOs (AO1, AO2, AO3) I am hitting, find the weakest sentence, and ask a Socratic question to force me to elevate it."
+
 api_key = st.secrets.get("GEMINI_API_KEY", None)
 if not api_key:
     api_key = st.sidebar.text_input("Enter Google Gemini API Key", type="password")
 
+# --- STAFF ACCOUNTS ---
+admin_users = [n.strip().lower() for n in str(st.secrets.get("ADMIN_USERS", "")).split(",") if n.strip()]
+teacher_users = [n.strip().lower() for n in str(st.secrets.get("TEACHER_USERS", "")).split(",") if n.strip()] + admin_users
+
 # --- PURE gTTS AUDIO GENERATOR ---
+@traced("generate_audio_bytes")
 def generate_audio_bytes(text):
-    """Uses synchronous gTTS. 100% crash proof inside Streamlit."""
+    """Uses synchronous gTTS behind the shared disk cache. 100% crash proof inside Streamlit."""
     try:
-        safe_text = text[:1500] 
-        tts = gTTS(text=safe_text, lang='en', tld='co.uk')
-        fp = io.BytesIO()
-        tts.write_to_fp(fp)
-        return fp.getvalue()
+        return cached_speech(text)
     except Exception as e:
         st.error(f"Audio Generation Error: {e}")
         return None
 
-def clean_text_for_speech(text):
-    clean_speech = re.sub(r'!\[.*?\]\((.*?)\)', '', text)
-    clean_speech = re.sub(r'\[.*?\]\((.*?)\)', '', clean_speech)
-    clean_speech = re.sub(r'http[s]?://\S+', '', clean_speech) 
-    clean_speech = clean_speech.replace('**', '').replace('#', '').replace('`', '').replace('_', '')
-    clean_speech = re.sub(r'^\s*[\*\-]\s+', ' ', clean_speech, flags=re.MULTILINE)
-    return re.sub(r'\s+', ' ', clean_speech).strip()
-
 # --- BACKGROUND DOSSIER SAVER (INACTIVITY TIMER) ---
 def background_dossier_save(username, chat_history_str, selected_topic):
     """Runs silently in a background thread when the student stops typing for 5 minutes."""
     try:
-        db = load_data()
-        if username not in db: return
-        user_data = db[username]
+        import google.generativeai as genai
+        user_data, version = load_student(username, priority=BACKGROUND)
+        if user_data is None: return
+        base = dict(user_data)
         
         summary_model = genai.GenerativeModel(model_name=FALLBACK_MODEL)
         
@@ -253,8 +268,11 @@ def background_dossier_save(username, chat_history_str, selected_topic):
         response = summary_model.generate_content(memory_prompt)
         user_data["summary"] = response.text.strip()
         
-        save_current_student(username, user_data)
+        # If the student's tab rewrote the dossier while we were thinking, theirs wins
+        save_current_student(username, user_data, priority=BACKGROUND, base=base, base_version=version)
         print(f"✅ Inactivity Timer triggered! Dossier saved for {username}.")
+    except StaleWriteError as e:
+        print(f"Background save skipped for {username}: {e}")
     except Exception as e:
         print(f"Background save failed: {e}")
 
@@ -333,6 +351,152 @@ def convert_history_for_gemini(history):
             gemini_history.append({"role": role, "parts": [content]})
     return gemini_history
 
+# --- BULK MARKING (TEACHERS) ---
+def mark_bulk_script(script, system_instruction):
+    """One script through the AQA review prompt. Runs on a bulk-marking worker thread."""
+    import google.generativeai as genai
+    prompt_parts = [AQA_REVIEW_PROMPT] + script.parts
+    try:
+        model = genai.GenerativeModel(model_name=PRIMARY_MODEL, system_instruction=system_instruction)
+        return model.generate_content(prompt_parts).text.strip()
+    except Exception as e:
+        # Quota errors go back to the rate limiter to back off; anything else tries flash-lite
+        if is_retryable_error(e):
+            raise
+        model = genai.GenerativeModel(model_name=FALLBACK_MODEL, system_instruction=system_instruction)
+        return model.generate_content(prompt_parts).text.strip()
+
+def show_bulk_job(job):
+    """Per-script results for one bulk-marking job."""
+    counts = job.counts()
+    finished_count = counts["done"] + counts["failed"]
+    st.subheader(f"📚 Bulk Marking: {job.batch_label}")
+    st.progress(finished_count / max(1, counts["total"]), text=f"{finished_count} of {counts['total']} scripts marked ({counts['failed']} failed)")
+
+    icons = {"queued": "⏳", "marking": "🖍️", "done": "✅", "failed": "❌"}
+    for s in job.snapshot():
+        icon = icons.get(s["state"], "🔁")
+        with st.expander(f"{icon} Script {s['script']} — {s['source']} ({s['state']})"):
+            if s["feedback"]:
+                st.markdown(s["feedback"])
+                st.caption(f"Marked in {s['seconds']:.0f}s")
+            else:
+                st.caption("Waiting for Christine...")
+
+@st.fragment(run_every=1.0)
+def bulk_marking_progress():
+    """Live per-script progress. Re-renders itself every second without rerunning the whole page."""
+    job = st.session_state.get("bulk_job")
+    if job is None:
+        return
+    if job.finished:
+        # One full rerun swaps this for the static results view, which stops the polling
+        st.rerun()
+    show_bulk_job(job)
+
+def bulk_marking_results(job):
+    """The finished job: no polling, just the results and whether they reached the sheet."""
+    show_bulk_job(job)
+    if job.saved:
+        st.success("All results saved to the 'Marking Results' tab in one update.")
+    elif job.save_error:
+        st.error(f"Marking finished but the results could not be saved: {job.save_error}")
+    if st.button("🧹 Clear bulk marking results"):
+        st.session_state.pop("bulk_job", None)
+        st.rerun()
+
+# --- STAFF CONSOLE (TEACHERS AND ADMINS) ---
+def staff_console(username):
+    """Bulk marking and the class report. Staff skip student onboarding entirely, so they
+    never get a student row in the sheet or show up in their own class report."""
+    import google.generativeai as genai
+    genai.configure(api_key=api_key)
+
+    st.info(f"Hi {username}! Your marking and class report tools are in the sidebar.")
+    st.sidebar.title(f"🧑‍🏫 {username}'s Staff Tools")
+    aqa_status, aqa_kb_content, aqa_ready = load_aqa_rubric()
+    st.sidebar.caption("🧠 System Integrity")
+    st.sidebar.markdown(f"**AQA Knowledge Base:** {aqa_status}")
+    st.session_state.aqa_knowledge = aqa_kb_content if aqa_ready else "[System: AQA Rubric file missing.]"
+    st.sidebar.markdown("---")
+
+    syllabus_data = load_syllabus()
+    course_list = list(syllabus_data.keys())
+    selected_course = st.sidebar.selectbox("Course:", course_list, key="staff_course")
+    selected_topic = st.sidebar.selectbox("Topic:", syllabus_data.get(selected_course, ["General Topic"]), key="staff_topic")
+    current_subject = f"{selected_course}: {selected_topic}"
+
+    # --- BULK MARKING UI ---
+    st.sidebar.markdown("---")
+    st.sidebar.header("📚 Bulk Marking")
+    bulk_files = st.sidebar.file_uploader(
+        "Class set: one PDF or many photos",
+        type=['png', 'jpg', 'jpeg', 'webp', 'pdf'],
+        accept_multiple_files=True,
+        key="bulk_files"
+    )
+    pages_per_script = st.sidebar.number_input("Pages per script", min_value=1, max_value=40, value=1, step=1)
+    batch_label = st.sidebar.text_input("Batch name", value=f"{selected_topic} mock")
+    bulk_job = st.session_state.get("bulk_job")
+    bulk_busy = bulk_job is not None and not bulk_job.finished
+
+    if st.sidebar.button("🖍️ Mark all scripts (AQA)", disabled=bulk_busy or not bulk_files):
+        try:
+            scripts = split_scripts([(f.name, f.getvalue()) for f in bulk_files], pages_per_script)
+        except Exception as e:
+            st.sidebar.error(f"Could not split the upload into scripts: {e}")
+        else:
+            bulk_instruction = get_system_instruction(
+                "GCSE", f"AQA {current_subject}", "Bulk marking of a class set: no individual student history."
+            )
+            st.session_state.bulk_job = BulkMarkingJob(
+                scripts,
+                partial(mark_bulk_script, system_instruction=bulk_instruction),
+                teacher=username,
+                batch_label=batch_label,
+                on_complete=lambda rows: write_results(sheets_conn.wait().workbook, rows),
+            ).start()
+            st.sidebar.success(f"Marking {len(scripts)} scripts...")
+
+    bulk_job = st.session_state.get("bulk_job")
+    if bulk_job is not None and bulk_job.finished:
+        bulk_marking_results(bulk_job)
+    elif bulk_job is not None:
+        bulk_marking_progress()
+
+    # --- CLASS MASTERY REPORT ---
+    st.sidebar.markdown("---")
+    if st.sidebar.toggle("📊 Class mastery report", key="cohort_toggle"):
+        with st.container(border=True):
+            report_start = time.perf_counter()
+            with span("cohort_report"):
+                try:
+                    # Only refresh the shared cache if stale; the report reads summaries straight from it
+                    STUDENTS.ensure_loaded(fetch_student_rows)
+                    # Staff rows left over from before they had their own console aren't students
+                    report = cohort_report(STUDENTS, syllabus_data, exclude=teacher_users)
+                except Exception as e:
+                    report = None
+                    st.error(f"Could not build the class report: {e}")
+            if report is not None:
+                st.subheader("📊 Class Mastery Report")
+                st.caption(f"{len(report.students)} students, {len(report.topics)} topics. Served in {(time.perf_counter() - report_start) * 1000:.0f} ms (matrix built in {report.built_ms:.0f} ms, reused until a dossier changes).")
+
+                report_courses = [c for c in course_list if c in report.topic_course]
+                if OTHER_COURSE in report.topic_course:
+                    report_courses.append(OTHER_COURSE)
+                report_course = st.selectbox("Show topics for:", ["All courses"] + report_courses, key="cohort_course")
+                chosen_course = None if report_course == "All courses" else report_course
+
+                st.markdown("**Where the class has the most gaps**")
+                st.dataframe(report.topic_table(chosen_course), use_container_width=True, hide_index=True)
+
+                with st.expander("Course totals"):
+                    st.dataframe(report.course_table(), use_container_width=True, hide_index=True)
+                if chosen_course:
+                    with st.expander("Topic × student matrix (mastered ✅ / gaps ⚠️)"):
+                        st.dataframe(report.matrix_rows(chosen_course), use_container_width=True, hide_index=True)
+
 # --- MAIN APP UI ---
 st.title("🎓 Christine: AI Tutor")
 
@@ -348,10 +512,19 @@ if "use_vault" not in st.session_state: st.session_state.use_vault = False
 if "auto_play_text" not in st.session_state:
     st.session_state.auto_play_text = None
     
+# Start pulling profiles now so they are ready by the time the name is submitted
+if "profile_prefetch" not in st.session_state:
+    st.session_state.profile_prefetch = start_profile_prefetch()
+
 raw_username = st.text_input("Please enter your first name to begin:", key="username_input")
 username = raw_username.strip().lower() if raw_username else ""
 
-if username and api_key:
+if username and api_key and username in teacher_users:
+    staff_console(username)
+
+elif username and api_key:
+    import google.generativeai as genai
+    from PIL import Image
     genai.configure(api_key=api_key)
     
     if "user_data" not in st.session_state or st.session_state.get("current_user") != username:
@@ -360,19 +533,27 @@ if username and api_key:
             st.session_state.last_processed_audio_id = None
             st.session_state.captured_image = None
             
-            db = load_data()
-            if username not in db:
+            prefetch_ready = st.session_state.pop("profile_prefetch", None)
+            if prefetch_ready:
+                prefetch_ready.wait(10)
+            try:
+                profile, profile_version = load_student(username)
+            except Exception as e:
+                st.error(f"⚠️ Database connection paused. Please refresh the page. (System code: {e})")
+                st.stop()
+
+            # Remember what this tab loaded, so its saves can be compare-and-swapped
+            st.session_state.user_base = profile
+            st.session_state.user_version = profile_version
+            if profile is None:
                 st.session_state.user_data = {"age": None, "history": [], "summary": "New student.", "file_vault": ""}
             else:
-                st.session_state.user_data = db[username]
-                saved_topic = db[username].get("last_topic", "a new topic")
+                st.session_state.user_data = copy.deepcopy(profile)
+                saved_topic = profile.get("last_topic", "a new topic")
                 if saved_topic == "": saved_topic = "a new topic"
                 
                 if len(st.session_state.user_data.get("history", [])) == 0:
-                    if db[username].get("file_vault", "").strip():
-                        welcome_msg = f"Welcome back, {username.title()}! I see you have a document saved in your Vault. If you want to use it today, just turn on **'📖 Use Vault Document in Chat'** in the sidebar. Otherwise, how can we start?"
-                    else:
-                        welcome_msg = f"Welcome back, {username.title()}! How can we start today?"
+                    welcome_msg = welcome_message(username, has_vault=bool(profile.get("file_vault", "").strip()))
                     
                     st.session_state.user_data["history"] = [{
                         "role": "model", 
@@ -394,7 +575,7 @@ if username and api_key:
         if st.button("Start Learning"):
             user_data["age"] = age_input
             user_data["history"].append({"role": "model", "content": f"Hello {username}! I'm ready to help you with {subject_input}. How can we start?"})
-            save_current_student(username, user_data)
+            save_session_profile(username, user_data)
             st.rerun()
     else:
         # --- SIDEBAR TOOLS ---
@@ -434,7 +615,7 @@ if username and api_key:
         if current_subject != user_data.get("last_topic"):
             is_active_switch = user_data.get("last_topic") != ""
             user_data["last_topic"] = current_subject
-            save_current_student(username, user_data)
+            save_session_profile(username, user_data)
             
             if is_active_switch:
                 if st.session_state.unsummarized_messages > 0:
@@ -533,7 +714,7 @@ if username and api_key:
                 st.write(current_vault)
             if st.sidebar.button("🗑️ Clear Vault"):
                 user_data["file_vault"] = ""
-                save_current_student(username, user_data)
+                save_session_profile(username, user_data)
                 st.rerun()
                 
         elif file_input or st.session_state.captured_image:
@@ -563,7 +744,7 @@ if username and api_key:
                                 extracted_text = extracted_text[:35000] + "\n\n[SYSTEM WARNING: Document reached the maximum database size. The end of the document was truncated.]"
                                 
                             user_data["file_vault"] = extracted_text
-                            save_current_student(username, user_data)
+                            save_session_profile(username, user_data)
                             st.session_state.use_vault = True
                             st.sidebar.success("Saved to Vault instantly! You can close the file now.")
                             st.rerun()
@@ -600,7 +781,7 @@ if username and api_key:
                     
                     user_data["summary"] = memory_response.text.strip()
                     st.session_state.unsummarized_messages = 0
-                    save_current_student(username, user_data)
+                    save_session_profile(username, user_data)
                 except Exception as e:
                     st.warning(f"Dossier update skipped. Error: {e}")
 
@@ -673,8 +854,10 @@ if username and api_key:
 
         is_new_audio = False
         audio_id = None
+        raw_audio = None
         if user_audio:
-            audio_id = f"audio-{user_audio.size}"
+            raw_audio = user_audio.getvalue()
+            audio_id = f"audio-{audio_fingerprint(raw_audio)}"
             if audio_id != st.session_state.last_processed_audio_id:
                 is_new_audio = True
 
@@ -698,7 +881,9 @@ if username and api_key:
                 current_turn_content.append(user_text)
 
             if has_audio:
-                audio_part = {"mime_type": "audio/wav", "data": user_audio.getvalue()}
+                with span("audio_preprocess"):
+                    voice_bytes, voice_report = preprocess_voice(raw_audio)
+                audio_part = {"mime_type": "audio/wav", "data": voice_bytes}
                 current_turn_content.append(audio_part)
                 display_text += "\n\n[🎤 Voice Message]"
                 st.session_state.last_processed_audio_id = audio_id
@@ -717,7 +902,7 @@ if username and api_key:
                         current_turn_content.append(pil_image)
                     
                     if image_action == "Review my essay/paragraph (AQA Mark Scheme)":
-                        action_prompt = "SYSTEM OVERRIDE: Act as a strict AQA Examiner. Do NOT rewrite the essay. Tell me which AOs (AO1, AO2, AO3) I am hitting, find the weakest sentence, and ask a Socratic question to force me to elevate it."
+                        action_prompt = AQA_REVIEW_PROMPT
                     elif image_action == "Socratic Extract Analysis (Guide me)":
                         action_prompt = "SYSTEM OVERRIDE: Analyze this extract. Do not give me answers. Ask the first Socratic question about the writer's methods to begin analysis."
                     elif image_action == "Blind Analysis Practice (Unseen Text)":
@@ -741,7 +926,10 @@ if username and api_key:
                         st.image(pil_image, caption="Work for Review")
                     elif pdf_part:
                         st.markdown(f"📄 **PDF Document Uploaded:** `{active_image.name}`")
-                if has_audio: st.audio(user_audio) 
+                if has_audio:
+                    st.audio(user_audio)
+                    voice_savings = describe_savings(voice_report)
+                    if voice_savings: st.caption(voice_savings)
             
             user_data["history"].append({"role": "user", "content": display_text})
 
@@ -788,30 +976,31 @@ if username and api_key:
 
                 with st.chat_message("assistant"):
                     with st.spinner("Christine is analyzing..."):
-                        try:
-                            # Primary Model execution
-                            model = genai.GenerativeModel(
-                                model_name=PRIMARY_MODEL, 
-                                system_instruction=system_instruction
-                            )
-                            if has_image or has_audio:
-                                prompt_parts = [system_instruction] + [msg['parts'][0] for msg in chat_history] + current_turn_content
-                                response = model.generate_content(prompt_parts)
-                            else:
-                                chat = model.start_chat(history=chat_history)
-                                response = chat.send_message(display_text)
-                        except Exception:
-                            # Fallback to flash-lite only on failure
-                            model = genai.GenerativeModel(
-                                model_name=FALLBACK_MODEL, 
-                                system_instruction=system_instruction
-                            )
-                            if has_image or has_audio:
-                                prompt_parts = [system_instruction] + [msg['parts'][0] for msg in chat_history] + current_turn_content
-                                response = model.generate_content(prompt_parts)
-                            else:
-                                chat = model.start_chat(history=chat_history)
-                                response = chat.send_message(display_text)
+                        with span("model_generation"):
+                            try:
+                                # Primary Model execution
+                                model = genai.GenerativeModel(
+                                    model_name=PRIMARY_MODEL, 
+                                    system_instruction=system_instruction
+                                )
+                                if has_image or has_audio:
+                                    prompt_parts = [system_instruction] + [msg['parts'][0] for msg in chat_history] + current_turn_content
+                                    response = model.generate_content(prompt_parts)
+                                else:
+                                    chat = model.start_chat(history=chat_history)
+                                    response = chat.send_message(display_text)
+                            except Exception:
+                                # Fallback to flash-lite only on failure
+                                model = genai.GenerativeModel(
+                                    model_name=FALLBACK_MODEL, 
+                                    system_instruction=system_instruction
+                                )
+                                if has_image or has_audio:
+                                    prompt_parts = [system_instruction] + [msg['parts'][0] for msg in chat_history] + current_turn_content
+                                    response = model.generate_content(prompt_parts)
+                                else:
+                                    chat = model.start_chat(history=chat_history)
+                                    response = chat.send_message(display_text)
                     
                         # Clean the raw answer of audio tags
                         answer = response.text.replace("🎤 Voice Response", "").replace("🎤 Voice response", "").replace("🎤 Voice Message", "").replace("🎤 [Voice Message]", "").replace("*[🎤 Voice Message]*", "").strip()
@@ -835,17 +1024,22 @@ if username and api_key:
                                 # Use Streamlit's st.status to show the live work
                                 with st.status(f"🔍 Searching the web for: '{search_term}'...", expanded=True) as status:
                                     image_url = fetch_web_image(search_term)
+                                    image_bytes = load_display_image(image_url) if image_url else None
+                                    if image_url and not image_bytes:
+                                        # Dead link: the next lookup skips it and searches for another
+                                        image_url = fetch_web_image(search_term)
+                                        image_bytes = load_display_image(image_url) if image_url else None
                                     
-                                    if image_url:
+                                    if image_bytes:
                                         status.update(label=f"✅ Found image for '{search_term}'", state="complete", expanded=False)
+                                    elif image_url:
+                                        status.update(label=f"❌ Found a link for '{search_term}', but it wasn't a usable image", state="error", expanded=True)
                                     else:
                                         status.update(label=f"❌ No image found for '{search_term}'", state="error", expanded=True)
                                 
-                                if image_url:
-                                    try:
-                                        st.image(image_url, caption=f"Visual Reference: {search_term}", use_container_width=True)
-                                    except:
-                                        st.caption(f"*(Attempted to load an image for {search_term}, but the link was invalid.)*")
+                                # Serve our resized copy, so the browser never touches the original host
+                                if image_bytes:
+                                    st.image(image_bytes, caption=f"Visual Reference: {search_term}", use_container_width=True)
                         
                         history_answer = display_answer + history_tags
                         
@@ -862,7 +1056,7 @@ if username and api_key:
                 
                 # Append the response (with the hidden tags intact for historical tracking) to memory
                 user_data["history"].append({"role": "model", "content": history_answer})
-                save_current_student(username, user_data)
+                save_session_profile(username, user_data)
                 st.session_state.unsummarized_messages += 2
 
                 if st.session_state.captured_image:
@@ -884,3 +1078,38 @@ if username and api_key:
 
 elif not api_key:
      st.warning("Please configure your API Key.")
+
+# --- ADMIN-ONLY PERFORMANCE PANEL ---
+if username and username in admin_users:
+    st.sidebar.markdown("---")
+    if st.sidebar.toggle("📊 Show performance panel", key="perf_panel_toggle"):
+        this_turn = TRACER.turn_spans()
+        if any(s["stage"] == "model_generation" for s in this_turn):
+            st.session_state.last_turn_spans = this_turn
+        shown_turn = st.session_state.get("last_turn_spans", this_turn)
+
+        with st.sidebar.expander("⏱️ Last chat turn", expanded=True):
+            if shown_turn:
+                for sp in shown_turn:
+                    flag = "" if sp["ok"] else " ❌"
+                    st.caption(f"`{sp['stage']}` — **{sp['ms']:.0f} ms**{flag}")
+            else:
+                st.caption("No spans recorded yet.")
+
+        with st.sidebar.expander("📈 Rolling p50 / p95 (all sessions)"):
+            stage_stats = TRACER.stats()
+            if stage_stats:
+                st.table([
+                    {"stage": stage, "n": v["count"], "p50 ms": v["p50_ms"], "p95 ms": v["p95_ms"], "max ms": v["max_ms"]}
+                    for stage, v in sorted(stage_stats.items(), key=lambda kv: -kv[1]["p95_ms"])
+                ])
+            else:
+                st.caption("No spans recorded yet.")
+            st.caption("Image cache: " + " | ".join(f"{k} {v}" for k, v in IMAGE_BYTES_MEMORY.stats().items()))
+            st.caption("Sheets quota: " + " | ".join(f"{k} {v}" for k, v in QUOTA.stats().items()))
+            st.download_button(
+                "⬇️ Export spans (JSON lines)",
+                data=TRACER.export_jsonl(),
+                file_name="christine_perf_spans.jsonl",
+                mime="application/jsonl",
+            )
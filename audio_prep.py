@@ -0,0 +1,136 @@
+import hashlib
+import io
+import wave
+
+# --- VOICE-INPUT PREPROCESSING ---
+# st.audio_input hands us full-rate PCM WAV, silence and all. Gemini only needs
+# 16 kHz mono speech, so we trim the dead air, downmix and resample before upload.
+# numpy is imported lazily (see the note at the top of app.py).
+
+TARGET_RATE = 16000
+SILENCE_DBFS = -40.0
+FRAME_MS = 20
+PAD_MS = 200
+
+
+def audio_fingerprint(raw_bytes):
+    """Content hash of a recording. Two different recordings of the same length no longer collide."""
+    return hashlib.sha1(raw_bytes).hexdigest()[:16]
+
+
+def _pcm_to_float(frames, sample_width, channels):
+    import numpy as np
+
+    if sample_width == 1:
+        samples = (np.frombuffer(frames, dtype=np.uint8).astype(np.float32) - 128.0) / 128.0
+    elif sample_width == 2:
+        samples = np.frombuffer(frames, dtype="<i2").astype(np.float32) / 32768.0
+    elif sample_width == 3:
+        raw = np.frombuffer(frames, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+        ints = raw[:, 0] | (raw[:, 1] << 8) | (raw[:, 2] << 16)
+        ints = np.where(ints >= 1 << 23, ints - (1 << 24), ints)
+        samples = ints.astype(np.float32) / float(1 << 23)
+    elif sample_width == 4:
+        samples = np.frombuffer(frames, dtype="<i4").astype(np.float32) / float(1 << 31)
+    else:
+        raise ValueError(f"Unsupported sample width: {sample_width} bytes")
+
+    usable = len(samples) - (len(samples) % channels)
+    return samples[:usable].reshape(-1, channels)
+
+
+def downmix_to_mono(samples):
+    return samples.mean(axis=1) if samples.shape[1] > 1 else samples[:, 0]
+
+
+def trim_silence(mono, rate, silence_dbfs=SILENCE_DBFS, frame_ms=FRAME_MS, pad_ms=PAD_MS):
+    """Cuts leading/trailing frames whose RMS is below silence_dbfs. Keeps a little padding
+    so the first and last syllables aren't clipped. An all-silent clip is returned unchanged."""
+    import numpy as np
+
+    frame_len = max(1, int(rate * frame_ms / 1000))
+    n_frames = len(mono) // frame_len
+    if n_frames == 0:
+        return mono
+
+    frames = mono[:n_frames * frame_len].reshape(n_frames, frame_len)
+    rms = np.sqrt(np.mean(frames * frames, axis=1))
+    loud = np.flatnonzero(rms > 10 ** (silence_dbfs / 20.0))
+    if loud.size == 0:
+        return mono
+
+    pad = int(rate * pad_ms / 1000)
+    start = max(0, loud[0] * frame_len - pad)
+    end = min(len(mono), (loud[-1] + 1) * frame_len + pad)
+    return mono[start:end]
+
+
+def resample(mono, rate, target_rate=TARGET_RATE):
+    """Box-filter then linear-interpolate. Crude next to a polyphase filter, but plenty for speech recognition."""
+    import numpy as np
+
+    if rate == target_rate or len(mono) == 0:
+        return mono
+    if rate > target_rate:
+        width = int(np.ceil(rate / target_rate))
+        if width > 1:
+            mono = np.convolve(mono, np.ones(width, dtype=np.float32) / width, mode="same")
+    n_out = max(1, int(round(len(mono) * target_rate / rate)))
+    src_positions = np.arange(n_out, dtype=np.float64) * (rate / target_rate)
+    return np.interp(src_positions, np.arange(len(mono)), mono).astype(np.float32)
+
+
+def _float_to_wav(mono, rate):
+    import numpy as np
+
+    pcm = (np.clip(mono, -1.0, 1.0) * 32767.0).astype("<i2")
+    out = io.BytesIO()
+    with wave.open(out, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        w.writeframes(pcm.tobytes())
+    return out.getvalue()
+
+
+def preprocess_voice(raw_bytes, target_rate=TARGET_RATE):
+    """Returns (wav_bytes, report). Anything we can't parse is passed through untouched."""
+    report = {"bytes_in": len(raw_bytes), "bytes_out": len(raw_bytes), "processed": False}
+    try:
+        with wave.open(io.BytesIO(raw_bytes), "rb") as w:
+            channels = w.getnchannels()
+            sample_width = w.getsampwidth()
+            rate = w.getframerate()
+            frames = w.readframes(w.getnframes())
+
+        samples = _pcm_to_float(frames, sample_width, channels)
+        mono = downmix_to_mono(samples)
+        trimmed = trim_silence(mono, rate)
+        resampled = resample(trimmed, rate, target_rate)
+        out = _float_to_wav(resampled, target_rate)
+    except Exception as e:
+        report["error"] = str(e)
+        return raw_bytes, report
+
+    if len(out) >= len(raw_bytes):
+        # Already lean (e.g. short 16 kHz mono clip): keep the original
+        return raw_bytes, report
+
+    report.update({
+        "bytes_out": len(out),
+        "processed": True,
+        "seconds_in": round(len(mono) / float(rate), 2),
+        "seconds_out": round(len(resampled) / float(target_rate), 2),
+        "channels_in": channels,
+        "rate_in": rate,
+    })
+    return out, report
+
+
+def describe_savings(report):
+    saved = report["bytes_in"] - report["bytes_out"]
+    if not report.get("processed") or saved <= 0:
+        return None
+    pct = int(100 * saved / report["bytes_in"])
+    return (f"🎛️ Voice note optimised: {report['bytes_in'] / 1024:.0f} KB → {report['bytes_out'] / 1024:.0f} KB "
+            f"({pct}% smaller, {report['seconds_in']}s → {report['seconds_out']}s)")
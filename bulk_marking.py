@@ -0,0 +1,184 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from sheets_quota import BACKGROUND, QUOTA, SheetsQuotaManager
+
+# --- BULK ESSAY MARKING (TEACHER MODE) ---
+# A teacher uploads a whole class set (one multi-page PDF or a pile of photos).
+# It is split into separate scripts, each one goes through the AQA review
+# prompt on a small worker pool, and all results land in the sheet in ONE write.
+# Nothing here touches Streamlit: the app polls BulkMarkingJob.snapshot().
+
+BULK_WORKERS = 3
+BULK_SCRIPT_RETRIES = 2
+MODEL_REQUESTS_PER_MINUTE = 12
+RESULTS_WORKSHEET = "Marking Results"
+RESULTS_HEADER = ["Marked At", "Teacher", "Batch", "Script", "Source", "Status", "Feedback"]
+MAX_CELL_CHARS = 45000
+
+IMAGE_MIME_TYPES = {
+    "png": "image/png",
+    "jpg": "image/jpeg",
+    "jpeg": "image/jpeg",
+    "webp": "image/webp",
+}
+
+# The Sheets token bucket works just as well for Gemini: same 429 handling, own budget.
+# It is the only retry layer, so a failing script costs at most BULK_SCRIPT_RETRIES extra calls.
+MODEL_QUOTA = SheetsQuotaManager(per_minute=MODEL_REQUESTS_PER_MINUTE, burst=BULK_WORKERS,
+                                 max_retries=BULK_SCRIPT_RETRIES, label="Gemini")
+
+
+class Script:
+    def __init__(self, number, source, parts):
+        self.number = number
+        self.source = source
+        self.parts = parts
+
+
+# --- SPLITTING ---
+def split_pdf(name, data, pages_per_script):
+    """Cuts one class-set PDF into (source label, pdf bytes) chunks of pages_per_script pages."""
+    import io
+    from PyPDF2 import PdfReader, PdfWriter
+
+    reader = PdfReader(io.BytesIO(data))
+    total = len(reader.pages)
+    chunks = []
+    for start in range(0, total, pages_per_script):
+        end = min(start + pages_per_script, total)
+        writer = PdfWriter()
+        for page in reader.pages[start:end]:
+            writer.add_page(page)
+        out = io.BytesIO()
+        writer.write(out)
+        label = f"{name} p{start + 1}" if end - start == 1 else f"{name} p{start + 1}-{end}"
+        chunks.append((label, out.getvalue()))
+    return chunks
+
+
+def split_scripts(files, pages_per_script=1):
+    """files is a list of (filename, bytes) in upload order.
+
+    PDFs are cut every pages_per_script pages. Photos are grouped in upload
+    order, pages_per_script photos to a script, so a 3-page essay shot as
+    three photos stays together.
+    """
+    pages_per_script = max(1, int(pages_per_script))
+    scripts = []
+    photo_group = []
+
+    def flush_photos():
+        if photo_group:
+            source = ", ".join(n for n, _ in photo_group)
+            scripts.append(Script(len(scripts) + 1, source, [part for _, part in photo_group]))
+            photo_group.clear()
+
+    for name, data in files:
+        ext = name.lower().rsplit(".", 1)[-1]
+        if ext == "pdf":
+            flush_photos()
+            for label, chunk in split_pdf(name, data, pages_per_script):
+                scripts.append(Script(len(scripts) + 1, label, [{"mime_type": "application/pdf", "data": chunk}]))
+        elif ext in IMAGE_MIME_TYPES:
+            photo_group.append((name, {"mime_type": IMAGE_MIME_TYPES[ext], "data": data}))
+            if len(photo_group) >= pages_per_script:
+                flush_photos()
+        else:
+            raise ValueError(f"Unsupported file type: {name}")
+    flush_photos()
+    return scripts
+
+
+# --- THE JOB ---
+class BulkMarkingJob:
+    """Marks every script on a bounded pool in a background thread.
+
+    mark_one(script) -> feedback text does the model call (the app supplies it, so the
+    prompt and fallback model match a normal chat turn). on_complete(rows) is called
+    once at the end with one sheet row per script.
+    """
+
+    def __init__(self, scripts, mark_one, teacher, batch_label, workers=BULK_WORKERS, on_complete=None):
+        self.scripts = scripts
+        self.mark_one = mark_one
+        self.teacher = teacher
+        self.batch_label = batch_label
+        self.workers = workers
+        self.on_complete = on_complete
+        self.started_at = time.time()
+        self.finished = False
+        self.saved = False
+        self.save_error = None
+
+        self._lock = threading.Lock()
+        self._states = [{"script": s.number, "source": s.source, "state": "queued", "feedback": "", "seconds": 0.0}
+                        for s in scripts]
+
+    def start(self):
+        threading.Thread(target=self._run, daemon=True).start()
+        return self
+
+    def _set(self, index, **fields):
+        with self._lock:
+            self._states[index].update(fields)
+
+    def _mark(self, index):
+        script = self.scripts[index]
+        started = time.perf_counter()
+        self._set(index, state="marking")
+        try:
+            # MODEL_QUOTA backs off and retries quota errors; mark_one falls back to flash-lite on the rest
+            feedback = MODEL_QUOTA.call(self.mark_one, script)
+        except Exception as e:
+            self._set(index, state="failed", feedback=f"Marking failed: {e}", seconds=time.perf_counter() - started)
+            return
+        self._set(index, state="done", feedback=feedback, seconds=time.perf_counter() - started)
+
+    def _run(self):
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            list(pool.map(self._mark, range(len(self.scripts))))
+        if self.on_complete:
+            try:
+                self.on_complete(self.result_rows())
+                self.saved = True
+            except Exception as e:
+                self.save_error = e
+                print(f"Bulk marking results could not be saved: {e}")
+        # Only now, so the UI never shows a finished job whose save is still in flight
+        self.finished = True
+
+    def snapshot(self):
+        with self._lock:
+            return [dict(s) for s in self._states]
+
+    def counts(self):
+        states = [s["state"] for s in self.snapshot()]
+        return {
+            "done": states.count("done"),
+            "failed": states.count("failed"),
+            "total": len(states),
+        }
+
+    def result_rows(self):
+        stamp = time.strftime("%Y-%m-%d %H:%M", time.localtime(self.started_at))
+        return [
+            [stamp, self.teacher, self.batch_label, s["script"], s["source"], s["state"], s["feedback"][:MAX_CELL_CHARS]]
+            for s in self.snapshot()
+        ]
+
+
+# --- SAVING ---
+def write_results(workbook, rows):
+    """Appends every script's result to the Marking Results tab in a single Sheets write."""
+    try:
+        ws = QUOTA.call(workbook.worksheet, RESULTS_WORKSHEET, priority=BACKGROUND)
+    except Exception as e:
+        if type(e).__name__ != "WorksheetNotFound":
+            raise
+        ws = QUOTA.call(workbook.add_worksheet, title=RESULTS_WORKSHEET, rows=1000, cols=len(RESULTS_HEADER),
+                        priority=BACKGROUND, idempotent=False)
+        rows = [RESULTS_HEADER] + rows
+    # RAW: feedback and file names come from student uploads, so nothing may be parsed as a formula
+    QUOTA.call(ws.append_rows, rows, value_input_option="RAW", priority=BACKGROUND, idempotent=False)
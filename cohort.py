@@ -0,0 +1,163 @@
+import hashlib
+import json
+import re
+import threading
+import time
+
+# --- COHORT MASTERY REPORT ---
+# Turns every student's dossier into one topic x student matrix of MASTERED and
+# GAP tags, so a teacher can see where the whole class is weakest. The matrix is
+# rebuilt only when some dossier actually changes (StudentCache.dossier_version),
+# so repeat views are served straight from memory.
+# numpy is imported lazily (see the note at the top of app.py).
+
+TAG_PATTERN = re.compile(r"^[\s\-\*•]*\[(?P<topic>[^\]]+)\]\s*(?P<kind>MASTERED|GAP)\b", re.IGNORECASE | re.MULTILINE)
+OTHER_COURSE = "Other / untracked"
+
+
+def extract_tags(summary):
+    """Returns [(topic, "mastered" | "gap"), ...] for every tagged dossier line."""
+    return [(m.group("topic").strip(), m.group("kind").lower()) for m in TAG_PATTERN.finditer(summary or "")]
+
+
+class CohortReport:
+    def __init__(self, topics, students, topic_course, mastered, gaps, built_ms):
+        self.topics = topics
+        self.students = students
+        self.topic_course = topic_course
+        self.mastered = mastered
+        self.gaps = gaps
+        self.built_ms = built_ms
+
+    def _topic_rows(self, mask):
+        import numpy as np
+
+        mastered_tags = self.mastered.sum(axis=1)
+        gap_tags = self.gaps.sum(axis=1)
+        students_with_gaps = (self.gaps > 0).sum(axis=1)
+        students_tracked = ((self.mastered + self.gaps) > 0).sum(axis=1)
+        total = mastered_tags + gap_tags
+        mastery = np.divide(mastered_tags * 100.0, total, out=np.zeros(len(self.topics)), where=total > 0)
+
+        order = np.lexsort((-gap_tags, -students_with_gaps))
+        return [
+            {
+                "Course": self.topic_course[i],
+                "Topic": self.topics[i],
+                "Students with gaps": int(students_with_gaps[i]),
+                "Students tracked": int(students_tracked[i]),
+                "Gap tags": int(gap_tags[i]),
+                "Mastered tags": int(mastered_tags[i]),
+                "Class mastery %": int(round(mastery[i])),
+            }
+            for i in order if mask[i]
+        ]
+
+    def topic_table(self, course=None):
+        """Topics sorted by how many students have gaps in them, optionally for one course."""
+        import numpy as np
+
+        mask = np.array([course is None or c == course for c in self.topic_course], dtype=bool)
+        return self._topic_rows(mask)
+
+    def course_table(self):
+        """Per-course totals, summed with bincount over each topic's course index."""
+        import numpy as np
+
+        courses = sorted(set(self.topic_course))
+        index = np.array([courses.index(c) for c in self.topic_course], dtype=np.int64)
+        mastered_tags = np.bincount(index, weights=self.mastered.sum(axis=1), minlength=len(courses))
+        gap_tags = np.bincount(index, weights=self.gaps.sum(axis=1), minlength=len(courses))
+
+        # A student "has gaps in a course" if any topic in that course has a GAP tag for them
+        per_course_gaps = np.zeros((len(courses), len(self.students)))
+        np.add.at(per_course_gaps, index, self.gaps)
+        students_with_gaps = (per_course_gaps > 0).sum(axis=1)
+
+        rows = []
+        for i, course in enumerate(courses):
+            total = mastered_tags[i] + gap_tags[i]
+            rows.append({
+                "Course": course,
+                "Students with gaps": int(students_with_gaps[i]),
+                "Gap tags": int(gap_tags[i]),
+                "Mastered tags": int(mastered_tags[i]),
+                "Class mastery %": int(round(100.0 * mastered_tags[i] / total)) if total else 0,
+            })
+        return sorted(rows, key=lambda r: -r["Gap tags"])
+
+    def matrix_rows(self, course=None):
+        """The raw topic x student matrix as 'mastered/gaps' cells, for one course."""
+        rows = []
+        for i, topic in enumerate(self.topics):
+            if course is not None and self.topic_course[i] != course:
+                continue
+            row = {"Topic": topic}
+            for j, student in enumerate(self.students):
+                m, g = int(self.mastered[i, j]), int(self.gaps[i, j])
+                row[student.title()] = f"{m}✅ {g}⚠️" if (m or g) else ""
+            rows.append(row)
+        return rows
+
+
+def build_cohort_report(summaries, curriculum):
+    """summaries is {student: dossier text}. One pass over every dossier; counting is done
+    with numpy.add.at on flat index arrays."""
+    import numpy as np
+
+    started = time.perf_counter()
+    students = sorted(summaries)
+
+    # Syllabus topics come first, in syllabus order; anything else tagged by the model goes under OTHER_COURSE
+    topics, topic_course, topic_index = [], [], {}
+    for course, course_topics in curriculum.items():
+        for topic in course_topics:
+            key = topic.lower()
+            if key not in topic_index:
+                topic_index[key] = len(topics)
+                topics.append(topic)
+                topic_course.append(course)
+
+    topic_ids, student_ids, is_gap = [], [], []
+    for j, name in enumerate(students):
+        for topic, kind in extract_tags(summaries[name]):
+            key = topic.lower()
+            if key not in topic_index:
+                topic_index[key] = len(topics)
+                topics.append(topic)
+                topic_course.append(OTHER_COURSE)
+            topic_ids.append(topic_index[key])
+            student_ids.append(j)
+            is_gap.append(kind == "gap")
+
+    mastered = np.zeros((len(topics), len(students)), dtype=np.int32)
+    gaps = np.zeros((len(topics), len(students)), dtype=np.int32)
+    if topic_ids:
+        t = np.array(topic_ids, dtype=np.int64)
+        s = np.array(student_ids, dtype=np.int64)
+        g = np.array(is_gap, dtype=bool)
+        np.add.at(gaps, (t[g], s[g]), 1)
+        np.add.at(mastered, (t[~g], s[~g]), 1)
+
+    return CohortReport(topics, students, topic_course, mastered, gaps, (time.perf_counter() - started) * 1000.0)
+
+
+# --- PROCESS-WIDE CACHE ---
+_cache_lock = threading.Lock()
+_cached = {"key": None, "report": None}
+
+
+def cohort_report(store, curriculum, exclude=()):
+    """Returns the cached report, rebuilding only if a dossier, the syllabus or the excluded
+    names (staff accounts) changed since last time."""
+    curriculum_key = hashlib.sha1(json.dumps(curriculum, sort_keys=True).encode("utf-8")).hexdigest()
+    exclude = frozenset(exclude)
+    key = (id(store), store.dossier_version(), curriculum_key, exclude)
+    with _cache_lock:
+        if _cached["key"] == key:
+            return _cached["report"]
+        summaries = {name: text for name, text in store.summaries().items() if name not in exclude}
+        report = build_cohort_report(summaries, curriculum)
+        _cached["key"] = key
+        _cached["report"] = report
+        return report
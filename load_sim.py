@@ -0,0 +1,438 @@
+"""Concurrent multi-student load simulator for capacity planning.
+
+Drives N simulated students at once through realistic sessions (log in, think,
+ask, maybe speak, get images and voice back, save, restart the inactivity timer)
+using the real quota manager, student cache, media cache and audio pipeline,
+with local stand-ins for Google Sheets, Gemini, gTTS and the image hosts. The
+stand-ins sleep for realistic latencies and the fake Sheets enforces Google's
+per-minute quota, so 429s and backoff happen the way they would in class.
+
+    python load_sim.py                          # 1, 5, 10, 20, 40 students
+    python load_sim.py --students 10,30,60 --turns 8
+    python load_sim.py --time-scale 1 --json results.json   # real-time run
+
+All sleeps (latencies, think time, quota window, inactivity timer) are multiplied
+by --time-scale, so the default 0.1 runs ten times faster than a real lesson.
+Once the students finish, each level waits for their pending inactivity timers to
+fire, so the background dossier saves are part of every run (--no-drain skips this).
+"""
+import argparse
+import io
+import json
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import wave
+from collections import Counter, deque
+from types import SimpleNamespace
+
+import media_cache
+from audio_prep import preprocess_voice
+from perf_tracer import PerfTracer
+from sheets_quota import BACKGROUND, INTERACTIVE, SheetsQuotaManager
+from student_cache import STUDENT_FIELDS, StaleWriteError, StudentCache
+
+IMAGE_TERMS = ["Plant cell", "Mitochondria", "Photosynthesis", "Volcano", "Trench warfare",
+               "Periodic table", "DNA", "Water cycle", "Macbeth", "Atom", "Magnet", "Heart"]
+INACTIVITY_SECONDS = 300.0
+
+
+# --- LOCAL STAND-INS FOR EXTERNAL SERVICES ---
+class Counters:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = Counter()
+
+    def add(self, key, n=1):
+        with self._lock:
+            self._counts[key] += n
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._counts)
+
+
+class FakeAPIError(Exception):
+    def __init__(self, status):
+        super().__init__(f"APIError: [{status}] RATE_LIMIT_EXCEEDED")
+        self.response = SimpleNamespace(status_code=status)
+
+
+def _sleep(mean, scale):
+    time.sleep(max(0.0, random.gauss(mean, mean * 0.3)) * scale)
+
+
+class FakeWorksheet:
+    """In-memory sheet1 with gspread's method names, latency and a per-minute quota."""
+
+    def __init__(self, counters, latency, per_minute, scale):
+        self.counters = counters
+        self.latency = latency
+        self.per_minute = per_minute
+        self.scale = scale
+        self.rows = [["Name", "Summary", "History", "Age", "Topic", "Vault"]]
+        self._lock = threading.Lock()
+        self._recent = deque()
+
+    def _request(self, kind):
+        with self._lock:
+            now = time.monotonic()
+            window = 60.0 * self.scale
+            while self._recent and now - self._recent[0] > window:
+                self._recent.popleft()
+            if len(self._recent) >= self.per_minute:
+                self.counters.add("sheets_429")
+                raise FakeAPIError(429)
+            self._recent.append(now)
+        self.counters.add(kind)
+        _sleep(self.latency, self.scale)
+
+    def get_all_values(self):
+        self._request("sheets_read")
+        with self._lock:
+            return [list(r) for r in self.rows]
+
+    def find(self, name, in_column=1):
+        self._request("sheets_read")
+        with self._lock:
+            for i, row in enumerate(self.rows):
+                if row[in_column - 1] == name:
+                    return SimpleNamespace(row=i + 1)
+        return None
+
+    def batch_update(self, updates, value_input_option=None):
+        self._request("sheets_write")
+        with self._lock:
+            for u in updates:
+                col = ord(u["range"][0]) - ord("A")
+                row = int(u["range"][1:]) - 1
+                self.rows[row][col] = u["values"][0][0]
+
+    def append_row(self, values):
+        self._request("sheets_write")
+        with self._lock:
+            self.rows.append([str(v) for v in values])
+
+
+def make_test_jpeg():
+    from PIL import Image
+    out = io.BytesIO()
+    Image.new("RGB", (1600, 1200), (90, 140, 200)).save(out, format="JPEG", quality=90)
+    return out.getvalue()
+
+
+def make_test_wav(seconds=6, rate=48000):
+    """A stereo 48 kHz clip with a second of silence either side, like a real voice note."""
+    import numpy as np
+    t = np.arange(int(seconds * rate)) / rate
+    voice = 0.3 * np.sin(2 * np.pi * 220 * t) * ((t > 1) & (t < seconds - 1))
+    pcm = (np.stack([voice, voice], axis=1) * 32767).astype("<i2")
+    out = io.BytesIO()
+    with wave.open(out, "wb") as w:
+        w.setnchannels(2)
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        w.writeframes(pcm.tobytes())
+    return out.getvalue()
+
+
+def install_media_stand_ins(counters, args, cache_dir):
+    """Points media_cache at a scratch directory and swaps its network calls for fakes."""
+    media_cache.CACHE_DIR = cache_dir
+    media_cache.IMAGE_SEARCH_CACHE = media_cache.DiskCache("image_search", ".json")
+    media_cache.TTS_CACHE = media_cache.DiskCache("tts", ".mp3", max_bytes=media_cache.TTS_DISK_BUDGET)
+    media_cache.IMAGE_BYTES_DISK = media_cache.DiskCache("images", ".img", max_bytes=media_cache.IMAGE_DISK_BUDGET)
+    media_cache.IMAGE_BYTES_MEMORY = media_cache.BoundedBytesCache(media_cache.IMAGE_MEMORY_BUDGET)
+    media_cache._bad_image_urls = media_cache.ExpiringSet(media_cache.BAD_IMAGE_URL_TTL)
+
+    jpeg = make_test_jpeg()
+
+    def fake_search(term, log=None):
+        counters.add("image_search")
+        _sleep(args.search_latency, args.time_scale)
+        return f"https://images.test/{term.replace(' ', '_')}.jpg"
+
+    def fake_download(url, max_bytes=None):
+        counters.add("image_download")
+        _sleep(args.download_latency, args.time_scale)
+        return jpeg
+
+    def fake_tts(text):
+        counters.add("tts")
+        _sleep(args.tts_latency, args.time_scale)
+        return b"ID3" + os.urandom(16 * 1024)
+
+    media_cache.search_image_url = fake_search
+    media_cache.download_image = fake_download
+    media_cache.synthesize_speech = fake_tts
+
+
+def fake_model(counters, args, kind="model"):
+    counters.add(kind)
+    _sleep(args.model_latency, args.time_scale)
+    terms = random.sample(IMAGE_TERMS, random.choice([0, 0, 1, 2]))
+    text = "Good thinking. What does that tell you about the process? " * 3
+    return text + "".join(f" [IMAGE_SEARCH: {t}]" for t in terms), terms
+
+
+# --- ONE SIMULATED STUDENT ---
+class SimEnv:
+    def __init__(self, args, counters):
+        scale = args.time_scale
+        self.args = args
+        self.counters = counters
+        self.sheet = FakeWorksheet(counters, args.sheets_latency, args.sheets_quota, scale)
+        self.quota = SheetsQuotaManager(per_minute=55 / scale, base_backoff=1.0 * scale, max_backoff=32.0 * scale)
+        self.cache = StudentCache()
+        self.tracer = PerfTracer(window=1_000_000, log_path="")
+        self.timers = []
+        self.timers_lock = threading.Lock()
+        self.wav = make_test_wav() if args.voice_share > 0 else None
+
+    def fetch_rows(self, priority=INTERACTIVE):
+        return self.quota.call(self.sheet.get_all_values, priority=priority, coalesce_key="students:get_all_values")
+
+    def save(self, name, data, base, base_version, priority=INTERACTIVE):
+        def write_fields(student, values):
+            cell = self.quota.call(self.sheet.find, student, in_column=1, priority=priority)
+            cols = dict(zip(STUDENT_FIELDS, "BCDEF"))
+            updates = [{"range": f"{cols[f]}{cell.row}", "values": [[v]]} for f, v in values.items()]
+            self.quota.call(self.sheet.batch_update, updates, value_input_option="USER_ENTERED", priority=priority)
+
+        def append_student(student, values):
+            self.quota.call(self.sheet.append_row, [student] + values, priority=priority, idempotent=False)
+
+        return self.cache.commit(name, base, base_version, data, write_fields, append_student)
+
+
+def background_dossier(env, name):
+    """Stand-in for app.background_dossier_save: read, summarise, compare-and-swap."""
+    try:
+        data, version = env.cache.snapshot(name)
+        if data is None:
+            return
+        base = dict(data)
+        fake_model(env.counters, env.args, kind="model_dossier")
+        data["summary"] = f"[Topic] MASTERED: something new at {time.time():.0f}"
+        env.save(name, data, base, version, priority=BACKGROUND)
+        env.counters.add("dossier_saved")
+    except StaleWriteError:
+        env.counters.add("dossier_skipped_stale")
+    except Exception:
+        env.counters.add("dossier_failed")
+
+
+def simulate_student(env, index, errors):
+    args = env.args
+    name = f"student{index:03d}"
+    voice_on = random.random() < args.tts_share
+    tracer = env.tracer
+
+    try:
+        _sleep(args.think, args.time_scale * random.random())
+        with tracer.span("login"):
+            env.cache.ensure_loaded(env.fetch_rows)
+            data, version = env.cache.snapshot(name)
+            base = data
+            if data is None:
+                data = {"age": 14, "history": [], "summary": "New student.", "file_vault": "", "last_topic": ""}
+                version, _ = env.save(name, data, None, 0)
+                base = dict(data, history=list(data["history"]))
+
+        timer = None
+        for turn in range(args.turns):
+            _sleep(args.think, args.time_scale)
+            with tracer.span("turn"):
+                if env.wav is not None and random.random() < args.voice_share:
+                    with tracer.span("audio_preprocess"):
+                        preprocess_voice(env.wav)
+                data["history"].append({"role": "user", "content": f"Question {turn} from {name}"})
+
+                with tracer.span("model_generation"):
+                    answer, terms = fake_model(env.counters, args)
+
+                for term in terms:
+                    with tracer.span("fetch_web_image"):
+                        url = media_cache.cached_image_url(term)
+                    with tracer.span("fetch_display_image"):
+                        media_cache.fetch_display_image(url)
+
+                if voice_on:
+                    with tracer.span("generate_audio_bytes"):
+                        media_cache.cached_speech(media_cache.clean_text_for_speech(answer))
+
+                data["history"].append({"role": "model", "content": answer})
+                with tracer.span("save_current_student"):
+                    try:
+                        version, others = env.save(name, data, base, version)
+                        data.update(others)
+                    except StaleWriteError as e:
+                        env.counters.add("save_conflict")
+                        version = e.version
+                        data.update(e.latest)
+                    base = dict(data, history=list(data["history"]))
+
+            # Same pattern as the app: a brand new threading.Timer on every turn
+            if timer is not None and timer.is_alive():
+                timer.cancel()
+            timer = threading.Timer(args.inactivity * args.time_scale, background_dossier, args=[env, name])
+            timer.daemon = True
+            timer.start()
+            with env.timers_lock:
+                env.timers.append(timer)
+    except Exception as e:
+        errors.append(f"{name}: {e}")
+
+
+# --- ONE LOAD LEVEL ---
+def current_rss_mb():
+    """Resident memory right now (ru_maxrss is a process-lifetime peak, so it can't show per-level growth)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1e6
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def run_level(n_students, args):
+    counters = Counters()
+    cache_dir = tempfile.mkdtemp(prefix="christine_sim_")
+    install_media_stand_ins(counters, args, cache_dir)
+    env = SimEnv(args, counters)
+    errors = []
+
+    peak_threads = [threading.active_count()]
+    stop = threading.Event()
+
+    def monitor():
+        while not stop.is_set():
+            peak_threads[0] = max(peak_threads[0], threading.active_count())
+            time.sleep(0.02)
+
+    rss_before = current_rss_mb()
+    tracemalloc.start()
+    mem_before = tracemalloc.get_traced_memory()[0]
+    monitor_thread = threading.Thread(target=monitor, daemon=True)
+    monitor_thread.start()
+
+    started = time.perf_counter()
+    students = [threading.Thread(target=simulate_student, args=(env, i, errors), daemon=True) for i in range(n_students)]
+    for t in students:
+        t.start()
+    for t in students:
+        t.join()
+    wall = time.perf_counter() - started
+
+    with env.timers_lock:
+        timers = list(env.timers)
+    live_timers = sum(1 for t in timers if t.is_alive())
+    drain_started = time.perf_counter()
+    for t in timers:
+        if args.no_drain:
+            t.cancel()
+        else:
+            # Let every student's last inactivity timer fire, like it would after the lesson
+            t.join()
+    drain = time.perf_counter() - drain_started
+    stop.set()
+    monitor_thread.join()
+    mem_after, mem_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    rss_after = current_rss_mb()
+    shutil.rmtree(cache_dir, ignore_errors=True)
+
+    stats = env.tracer.stats()
+    turns = stats.get("turn", {}).get("count", 0)
+    return {
+        "students": n_students,
+        "turns": turns,
+        "wall_s": round(wall, 2),
+        "wall_real_s": round(wall / args.time_scale, 1),
+        "drain_s": round(drain, 2),
+        # Throughput in real-world time too, so it lines up with the latencies below
+        "turns_per_s": round(turns / (wall / args.time_scale), 3) if wall else 0.0,
+        # Latencies are divided back out of the time scale, so they read as real-world seconds
+        "latency_real_s": {stage: {k.replace("_ms", "_s"): round(v / 1000.0 / args.time_scale, 2)
+                                   for k, v in s.items() if k != "count"}
+                           for stage, s in stats.items()},
+        "peak_threads": peak_threads[0],
+        "timers_alive_at_end": live_timers,
+        "mem_growth_mb": round((mem_after - mem_before) / 1e6, 2),
+        "mem_peak_mb": round(mem_peak / 1e6, 2),
+        "rss_mb": round(rss_after, 1),
+        "rss_growth_mb": round(rss_after - rss_before, 1),
+        "external_calls": counters.snapshot(),
+        "quota": env.quota.stats(),
+        "errors": errors[:5],
+        "error_count": len(errors),
+    }
+
+
+def print_level(r):
+    lat = r["latency_real_s"]
+    turn = lat.get("turn", {})
+    login = lat.get("login", {})
+    save = lat.get("save_current_student", {})
+    calls = r["external_calls"]
+    print(f"\n👥 {r['students']} students — {r['turns']} turns in {r['wall_s']}s "
+          f"(~{r['wall_real_s']}s of real lesson time, {r['turns_per_s']} turns/s real-world)")
+    print(f"   turn  p50 {turn.get('p50_s', 0)}s  p95 {turn.get('p95_s', 0)}s  max {turn.get('max_s', 0)}s   (real-world seconds)")
+    print(f"   login p50 {login.get('p50_s', 0)}s  p95 {login.get('p95_s', 0)}s   save p95 {save.get('p95_s', 0)}s")
+    print(f"   threads peak {r['peak_threads']}, inactivity timers pending when students finished {r['timers_alive_at_end']}")
+    print(f"   memory +{r['mem_growth_mb']} MB (peak {r['mem_peak_mb']} MB traced), RSS {r['rss_mb']} MB ({r['rss_growth_mb']:+} MB this level)")
+    print(f"   sheets reads {calls.get('sheets_read', 0)}, writes {calls.get('sheets_write', 0)}, "
+          f"429s {calls.get('sheets_429', 0)}, coalesced {r['quota']['coalesced']}, retries {r['quota']['retries']}")
+    print(f"   model {calls.get('model', 0)}, tts {calls.get('tts', 0)}, image search {calls.get('image_search', 0)}, "
+          f"downloads {calls.get('image_download', 0)}, save conflicts {calls.get('save_conflict', 0)}")
+    print(f"   dossiers (background lane, after {r['drain_s']}s drain): model {calls.get('model_dossier', 0)}, "
+          f"saved {calls.get('dossier_saved', 0)}, skipped stale {calls.get('dossier_skipped_stale', 0)}, "
+          f"failed {calls.get('dossier_failed', 0)}")
+    if r["error_count"]:
+        print(f"   🛑 {r['error_count']} student sessions failed, e.g. {r['errors'][0]}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Simulate N concurrent students against local service stand-ins.")
+    parser.add_argument("--students", default="1,5,10,20,40", help="comma-separated load levels")
+    parser.add_argument("--turns", type=int, default=5, help="chat turns per student")
+    parser.add_argument("--think", type=float, default=20.0, help="mean seconds a student thinks between turns")
+    parser.add_argument("--time-scale", type=float, default=0.1, help="multiply every sleep by this")
+    parser.add_argument("--model-latency", type=float, default=3.0)
+    parser.add_argument("--sheets-latency", type=float, default=0.4)
+    parser.add_argument("--sheets-quota", type=int, default=60, help="Sheets requests allowed per minute")
+    parser.add_argument("--tts-latency", type=float, default=1.5)
+    parser.add_argument("--search-latency", type=float, default=1.0)
+    parser.add_argument("--download-latency", type=float, default=0.5)
+    parser.add_argument("--tts-share", type=float, default=0.5, help="fraction of students with voice on")
+    parser.add_argument("--voice-share", type=float, default=0.2, help="fraction of turns spoken, not typed")
+    parser.add_argument("--inactivity", type=float, default=INACTIVITY_SECONDS,
+                        help="seconds of silence before the dossier timer fires (the app uses 300)")
+    parser.add_argument("--no-drain", action="store_true",
+                        help="cancel pending inactivity timers instead of waiting for their dossier saves")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--json", help="also write the full results to this file")
+    args = parser.parse_args(argv)
+
+    random.seed(args.seed)
+    levels = [int(n) for n in args.students.split(",") if n.strip()]
+    results = []
+    for n in levels:
+        result = run_level(n, args)
+        print_level(result)
+        results.append(result)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"\n💾 Full results written to {args.json}")
+    return 1 if any(r["error_count"] for r in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
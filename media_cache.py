@@ -0,0 +1,469 @@
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+# --- SHARED MEDIA CACHE (IMAGE SEARCH + TTS) ---
+# Image lookups and gTTS audio are cached on disk so that every session, and the
+# prewarm.py job that fills the cache before lessons start, share one copy.
+# Nothing in here imports Streamlit; callers pass their own log function.
+
+CACHE_DIR = os.environ.get("CHRISTINE_CACHE_DIR", ".christine_cache")
+IMAGE_MISS_TTL = 24 * 3600  # retry terms that found nothing once a day
+TTS_LANG = "en"
+TTS_TLD = "co.uk"
+TTS_MAX_CHARS = 1500
+
+IMAGE_DISPLAY_WIDTH = 800
+IMAGE_MAX_DOWNLOAD = 8 * 1024 * 1024
+IMAGE_MAX_PIXELS = 40_000_000
+IMAGE_MAX_REDIRECTS = 3
+IMAGE_MEMORY_BUDGET = 64 * 1024 * 1024
+IMAGE_DISK_BUDGET = 512 * 1024 * 1024
+BAD_IMAGE_URL_TTL = 15 * 60  # a failed link is skipped this long, then given another chance
+TTS_DISK_BUDGET = 128 * 1024 * 1024  # one-off model answers land here too, so it must stay bounded
+
+
+class DiskCache:
+    """Tiny content-addressed file cache. Writes are atomic, so concurrent writers are safe."""
+
+    def __init__(self, subdir, suffix, max_bytes=None):
+        self.path = os.path.join(CACHE_DIR, subdir)
+        self.suffix = suffix
+        self.max_bytes = max_bytes
+        self._puts = 0
+
+    def _file(self, key):
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.path, digest + self.suffix)
+
+    def get(self, key):
+        path = self._file(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+        if self.max_bytes:
+            # Bump the mtime so prune() drops the least recently *used* files, not just the oldest
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+        return data
+
+    def has(self, key):
+        return os.path.exists(self._file(key))
+
+    def put(self, key, data):
+        os.makedirs(self.path, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, self._file(key))
+        except Exception:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        self._puts += 1
+        if self.max_bytes and self._puts % 50 == 0:
+            self.prune()
+
+    def prune(self):
+        """Deletes the least recently used files until the directory fits in max_bytes."""
+        try:
+            entries = [os.path.join(self.path, f) for f in os.listdir(self.path) if f.endswith(self.suffix)]
+            stats = sorted(((os.path.getmtime(p), os.path.getsize(p), p) for p in entries))
+        except OSError:
+            return
+        total = sum(size for _, size, _ in stats)
+        for _, size, path in stats:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+
+class BoundedBytesCache:
+    """Thread-safe in-memory LRU with a total byte budget rather than an item count."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._items = OrderedDict()
+        self._size = 0
+
+    def get(self, key):
+        with self._lock:
+            value = self._items.get(key)
+            if value is not None:
+                self._items.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._size -= len(old)
+            self._items[key] = value
+            self._size += len(value)
+            while self._size > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self._size -= len(evicted)
+
+    def stats(self):
+        with self._lock:
+            return {"items": len(self._items), "bytes": self._size}
+
+
+class ExpiringSet:
+    """Thread-safe set whose members drop out after ttl seconds (oldest first past max_items)."""
+
+    def __init__(self, ttl, max_items=1024):
+        self.ttl = ttl
+        self.max_items = max_items
+        self._lock = threading.Lock()
+        self._expiry = OrderedDict()
+
+    def add(self, item):
+        with self._lock:
+            self._expiry.pop(item, None)
+            self._expiry[item] = time.monotonic() + self.ttl
+            while len(self._expiry) > self.max_items:
+                self._expiry.popitem(last=False)
+
+    def __contains__(self, item):
+        with self._lock:
+            expires = self._expiry.get(item)
+            if expires is None:
+                return False
+            if time.monotonic() >= expires:
+                del self._expiry[item]
+                return False
+            return True
+
+
+IMAGE_SEARCH_CACHE = DiskCache("image_search", ".json")
+TTS_CACHE = DiskCache("tts", ".mp3", max_bytes=TTS_DISK_BUDGET)
+IMAGE_BYTES_DISK = DiskCache("images", ".img", max_bytes=IMAGE_DISK_BUDGET)
+IMAGE_BYTES_MEMORY = BoundedBytesCache(IMAGE_MEMORY_BUDGET)
+
+
+class ImageSearchUnavailable(Exception):
+    """Nothing was found, but only because a search service errored, so it isn't a real miss."""
+
+
+def _quiet(message):
+    pass
+
+
+# --- HYBRID IMAGE ENGINE WITH WIKIPEDIA ARTICLE API ---
+def search_image_url(search_query, log=_quiet):
+    """Tries DuckDuckGo first. If blocked, searches Wikipedia articles for their main thumbnail.
+    Returns None only if every service answered; raises ImageSearchUnavailable if any of them failed."""
+    import requests
+    from duckduckgo_search import DDGS
+
+    errors = []
+    
+    # STEP 1: Try DuckDuckGo
+    try:
+        log(f"🦆 **DuckDuckGo:** Searching for `[{search_query}]`...")
+        results = DDGS().images(search_query, max_results=3, safesearch='Moderate')
+        if not results:
+             log("⚠️ *DuckDuckGo returned 0 results. (Likely a bot-block)*")
+        if results and len(results) > 0:
+            log(f"✅ *DuckDuckGo found {len(results)} images!*")
+            for r in results:
+                if r.get('image') and r.get('image') not in _bad_image_urls: return r.get('image')
+                
+        # If the search was too long, try shortening it for DDG
+        words = search_query.split()
+        if len(words) > 2:
+            short_query = " ".join(words[:2])
+            log(f"✂️ **DuckDuckGo Fallback:** Chopping query to `[{short_query}]`...")
+            short_results = DDGS().images(short_query, max_results=3)
+            if not short_results:
+                 log("⚠️ *DuckDuckGo fallback returned 0 results.*")
+            if short_results and len(short_results) > 0:
+                log(f"✅ *DuckDuckGo fallback found images!*")
+                for r in short_results:
+                    if r.get('image') and r.get('image') not in _bad_image_urls: return r.get('image')
+    except Exception as e:
+        log(f"🛑 *DuckDuckGo Crash Error: {e}*")
+        errors.append(f"DuckDuckGo: {e}")
+        
+    # STEP 2: Fallback to Wikipedia Article Images (Highly reliable)
+    def ask_wikipedia(query):
+        try:
+            log(f"🌍 **Wikipedia:** Searching for article about `[{query}]`...")
+            url = "https://en.wikipedia.org/w/api.php"
+            params = {
+                "action": "query",
+                "format": "json",
+                "generator": "search",
+                "gsrsearch": query,
+                "gsrlimit": 3,
+                "prop": "pageimages",
+                "pithumbsize": 800
+            }
+            headers = {
+                "User-Agent": "ChristineAITutor/1.0 (Educational App)"
+            }
+            response = requests.get(url, params=params, headers=headers, timeout=5).json()
+            pages = response.get("query", {}).get("pages", {})
+            
+            if not pages:
+                 log("⚠️ *Wikipedia returned 0 matching articles.*")
+                 return None
+                 
+            for page_id, page_data in pages.items():
+                if "thumbnail" in page_data:
+                    img_url = page_data["thumbnail"].get("source")
+                    if img_url in _bad_image_urls:
+                        continue
+                    title = page_data.get('title', 'Unknown')
+                    log(f"✅ *Wikipedia found an image from the article: '{title}'!*")
+                    return img_url
+            
+            log("⚠️ *Wikipedia found the article, but it has no main image.*")
+        except Exception as e:
+            log(f"🛑 *Wikipedia API Error: {e}*")
+            errors.append(f"Wikipedia: {e}")
+        return None
+
+    # Try full query
+    wiki_img = ask_wikipedia(search_query)
+    if wiki_img: return wiki_img
+    
+    # Try just the core noun (first word)
+    words = search_query.split()
+    if len(words) > 1:
+        short_wiki_query = words[0]
+        log(f"✂️ **Wikipedia Fallback:** Chopping query to single word `[{short_wiki_query}]`...")
+        short_wiki_img = ask_wikipedia(short_wiki_query)
+        if short_wiki_img: return short_wiki_img
+
+    if errors:
+        raise ImageSearchUnavailable("; ".join(errors))
+    return None
+
+
+def image_cache_key(search_query):
+    return re.sub(r"\s+", " ", search_query).strip().lower()
+
+
+def cached_image_entry(search_query):
+    """Returns the cached {"url", "at"} lookup for a term, or None if it is unknown or a stale miss."""
+    raw = IMAGE_SEARCH_CACHE.get(image_cache_key(search_query))
+    if raw is None:
+        return None
+    try:
+        entry = json.loads(raw)
+    except ValueError:
+        return None
+    if not entry.get("url") and time.time() - entry.get("at", 0) > IMAGE_MISS_TTL:
+        return None
+    return entry
+
+
+def cached_image_url(search_query, log=_quiet):
+    """search_image_url() behind the shared disk cache. Misses are remembered for IMAGE_MISS_TTL;
+    ImageSearchUnavailable propagates uncached, so an outage doesn't hide a term for a day.
+    A cached link that recently failed to download is replaced by a fresh search that skips it."""
+    entry = cached_image_entry(search_query)
+    replacing = entry is not None and entry.get("url") in _bad_image_urls
+    if replacing:
+        # fetch_display_image() couldn't use the cached link: look for another one
+        log(f"♻️ *Cached link for `[{search_query}]` failed recently, searching again.*")
+    elif entry is not None:
+        log(f"⚡ *Cached result for `[{search_query}]`.*")
+        return entry.get("url")
+
+    url = search_image_url(search_query, log=log)
+    if url is None and replacing:
+        # Only failed links were left, which is not a real miss; retry once they expire
+        return None
+    record = {"term": search_query, "url": url, "at": time.time()}
+    try:
+        IMAGE_SEARCH_CACHE.put(image_cache_key(search_query), json.dumps(record).encode("utf-8"))
+    except OSError as e:
+        print(f"Image cache write failed: {e}")
+    return url
+
+
+# --- SERVER-SIDE IMAGE FETCH + RESIZE ---
+# Students' browsers used to download full-size originals straight from DuckDuckGo
+# or Wikipedia, and a dead link only showed up at render time. Now the server
+# downloads each image once, checks it decodes, shrinks it to the chat column
+# width and serves those bytes from a memory LRU backed by the disk cache.
+_bad_image_urls = ExpiringSet(BAD_IMAGE_URL_TTL)
+
+
+def check_public_url(url):
+    """Raises ValueError unless url is http(s) on a host that resolves only to public addresses.
+    Search results are untrusted, so they must not steer the server at loopback, LAN or metadata IPs."""
+    import ipaddress
+    import socket
+    from urllib.parse import urlsplit
+
+    parts = urlsplit(url)
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        raise ValueError(f"refusing non-http(s) image URL: {url[:80]}")
+    try:
+        infos = socket.getaddrinfo(parts.hostname, parts.port or (443 if parts.scheme == "https" else 80),
+                                   proto=socket.IPPROTO_TCP)
+    except socket.gaierror as e:
+        raise ValueError(f"could not resolve {parts.hostname}: {e}")
+    for info in infos:
+        address = ipaddress.ip_address(info[4][0].split("%")[0])
+        if not address.is_global:
+            raise ValueError(f"refusing image host {parts.hostname} ({address} is not a public address)")
+
+
+def download_image(url, max_bytes=IMAGE_MAX_DOWNLOAD):
+    """Streams the image with a size cap. Raises on HTTP errors, non-images, oversized files or
+    non-public hosts. Redirects are followed by hand so every hop gets the same host check."""
+    import requests
+    from urllib.parse import urljoin
+
+    headers = {"User-Agent": "ChristineAITutor/1.0 (Educational App)"}
+    for _ in range(IMAGE_MAX_REDIRECTS + 1):
+        check_public_url(url)
+        with requests.get(url, headers=headers, timeout=8, stream=True, allow_redirects=False) as r:
+            if r.is_redirect:
+                url = urljoin(url, r.headers["Location"])
+                continue
+            r.raise_for_status()
+            content_type = r.headers.get("Content-Type", "")
+            if content_type and not content_type.startswith("image/"):
+                raise ValueError(f"not an image ({content_type})")
+            chunks = []
+            size = 0
+            for chunk in r.iter_content(64 * 1024):
+                size += len(chunk)
+                if size > max_bytes:
+                    raise ValueError(f"image larger than {max_bytes // (1024 * 1024)} MB")
+                chunks.append(chunk)
+        return b"".join(chunks)
+    raise ValueError(f"too many redirects (more than {IMAGE_MAX_REDIRECTS})")
+
+
+def resize_for_display(raw, width=IMAGE_DISPLAY_WIDTH):
+    """Verifies and decodes with PIL, shrinks to width (never enlarges), re-encodes.
+    Photos become JPEG; anything with transparency stays PNG so diagrams keep their background."""
+    import io
+    from PIL import Image
+
+    with Image.open(io.BytesIO(raw)) as probe:
+        probe.verify()
+
+    img = Image.open(io.BytesIO(raw))
+    if img.width * img.height > IMAGE_MAX_PIXELS:
+        raise ValueError(f"image too large to decode ({img.width}x{img.height})")
+    if img.format == "JPEG":
+        # Let libjpeg decode at a reduced scale instead of full size
+        img.draft("RGB", (width, width * 4))
+    img.thumbnail((width, width * 4))
+
+    has_alpha = img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info)
+    out = io.BytesIO()
+    if has_alpha:
+        img.convert("RGBA").save(out, format="PNG", optimize=True)
+    else:
+        img.convert("RGB").save(out, format="JPEG", quality=82, optimize=True, progressive=True)
+    return out.getvalue()
+
+
+def image_bytes_key(url, width):
+    return f"{width}|{url}"
+
+
+def fetch_display_image(url, width=IMAGE_DISPLAY_WIDTH, log=_quiet):
+    """Returns display-ready image bytes for url, or None if it can't be used."""
+    key = image_bytes_key(url, width)
+    data = IMAGE_BYTES_MEMORY.get(key)
+    if data is not None:
+        return data
+
+    data = IMAGE_BYTES_DISK.get(key)
+    if data:
+        IMAGE_BYTES_MEMORY.put(key, data)
+        return data
+
+    if url in _bad_image_urls:
+        log("⚠️ *This image link failed recently, skipping it.*")
+        return None
+
+    try:
+        raw = download_image(url)
+        data = resize_for_display(raw, width)
+    except Exception as e:
+        log(f"🛑 *Image download/decode failed: {e}*")
+        _bad_image_urls.add(url)
+        return None
+
+    log(f"🖼️ *Resized image: {len(raw) / 1024:.0f} KB → {len(data) / 1024:.0f} KB.*")
+    IMAGE_BYTES_MEMORY.put(key, data)
+    try:
+        IMAGE_BYTES_DISK.put(key, data)
+    except OSError as e:
+        print(f"Image cache write failed: {e}")
+    return data
+
+
+# --- TEXT TO SPEECH ---
+def clean_text_for_speech(text):
+    clean_speech = re.sub(r'!\[.*?\]\((.*?)\)', '', text)
+    clean_speech = re.sub(r'\[.*?\]\((.*?)\)', '', clean_speech)
+    clean_speech = re.sub(r'http[s]?://\S+', '', clean_speech) 
+    clean_speech = clean_speech.replace('**', '').replace('#', '').replace('`', '').replace('_', '')
+    clean_speech = re.sub(r'^\s*[\*\-]\s+', ' ', clean_speech, flags=re.MULTILINE)
+    return re.sub(r'\s+', ' ', clean_speech).strip()
+
+
+def tts_cache_key(text):
+    return f"{TTS_LANG}|{TTS_TLD}|{text[:TTS_MAX_CHARS]}"
+
+
+def synthesize_speech(text):
+    """Synchronous gTTS to MP3 bytes. Raises on failure."""
+    import io
+    from gtts import gTTS
+
+    tts = gTTS(text=text[:TTS_MAX_CHARS], lang=TTS_LANG, tld=TTS_TLD)
+    fp = io.BytesIO()
+    tts.write_to_fp(fp)
+    return fp.getvalue()
+
+
+def cached_speech(text):
+    """synthesize_speech() behind the shared disk cache, keyed on the exact spoken text."""
+    key = tts_cache_key(text)
+    audio = TTS_CACHE.get(key)
+    if audio:
+        return audio
+    audio = synthesize_speech(text)
+    try:
+        TTS_CACHE.put(key, audio)
+    except OSError as e:
+        print(f"TTS cache write failed: {e}")
+    return audio
+
+
+# --- STANDARD SPOKEN PHRASES ---
+# Shared by app.py and prewarm.py so the pre-synthesized audio matches exactly.
+def welcome_message(name, has_vault=False):
+    if has_vault:
+        return f"Welcome back, {name.title()}! I see you have a document saved in your Vault. If you want to use it today, just turn on **'📖 Use Vault Document in Chat'** in the sidebar. Otherwise, how can we start?"
+    return f"Welcome back, {name.title()}! How can we start today?"
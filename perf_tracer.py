@@ -0,0 +1,117 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+
+# --- HOT-PATH SPAN TRACER ---
+# One tracer per process. Streamlit re-runs app.py on every interaction but
+# imported modules stay loaded, so these rolling stats are shared by every session.
+
+TRACE_WINDOW = 500
+TRACE_LOG_PATH = os.environ.get("CHRISTINE_TRACE_LOG", "")
+
+
+def _percentile(sorted_values, pct):
+    """Nearest-rank percentile on an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(pct / 100.0 * len(sorted_values))))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+class PerfTracer:
+    def __init__(self, window=TRACE_WINDOW, log_path=TRACE_LOG_PATH):
+        self.window = window
+        self.log_path = log_path
+        self._lock = threading.Lock()
+        self._samples = {}
+        self._records = deque(maxlen=window)
+        self._local = threading.local()
+
+    # --- PER-TURN COLLECTION ---
+    def begin_turn(self):
+        """Starts collecting spans for the current script run on this thread."""
+        self._local.turn = []
+
+    def turn_spans(self):
+        return list(getattr(self._local, "turn", None) or [])
+
+    # --- RECORDING ---
+    def record(self, stage, duration_ms, ok=True, **fields):
+        entry = {"ts": round(time.time(), 3), "stage": stage, "ms": round(duration_ms, 2), "ok": ok}
+        entry.update(fields)
+
+        with self._lock:
+            if stage not in self._samples:
+                self._samples[stage] = deque(maxlen=self.window)
+            self._samples[stage].append(duration_ms)
+            self._records.append(entry)
+            if self.log_path:
+                try:
+                    with open(self.log_path, "a", encoding="utf-8") as f:
+                        f.write(json.dumps(entry) + "\n")
+                except Exception as e:
+                    print(f"Trace log write failed: {e}")
+
+        turn = getattr(self._local, "turn", None)
+        if turn is not None:
+            turn.append(entry)
+        return entry
+
+    @contextmanager
+    def span(self, stage, **fields):
+        """Times the wrapped block. Failures are still recorded (ok=False) and re-raised."""
+        start = time.perf_counter()
+        ok = True
+        try:
+            yield
+        except BaseException:
+            ok = False
+            raise
+        finally:
+            self.record(stage, (time.perf_counter() - start) * 1000.0, ok=ok, **fields)
+
+    def traced(self, stage):
+        """Decorator version of span() for whole functions."""
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.span(stage):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    # --- REPORTING ---
+    def stats(self):
+        """Returns {stage: {count, p50_ms, p95_ms, max_ms}} over the rolling window."""
+        with self._lock:
+            snapshot = {stage: sorted(values) for stage, values in self._samples.items()}
+
+        report = {}
+        for stage, values in snapshot.items():
+            report[stage] = {
+                "count": len(values),
+                "p50_ms": round(_percentile(values, 50), 1),
+                "p95_ms": round(_percentile(values, 95), 1),
+                "max_ms": round(values[-1], 1) if values else 0.0,
+            }
+        return report
+
+    def export_jsonl(self):
+        """Returns the rolling window of raw spans as JSON lines for offline analysis."""
+        with self._lock:
+            records = list(self._records)
+        return "".join(json.dumps(r) + "\n" for r in records)
+
+    def reset(self):
+        with self._lock:
+            self._samples.clear()
+            self._records.clear()
+
+
+TRACER = PerfTracer()
+span = TRACER.span
+traced = TRACER.traced
@@ -0,0 +1,155 @@
+"""Fills Christine's shared image and voice caches before lessons start.
+
+Walks every course and topic in the Syllabus sheet, looks up the [IMAGE_SEARCH]
+terms Christine is likely to ask for (downloading and resizing each image), and
+synthesizes the welcome phrase for each student with no saved chat history (the
+only students the app greets with it). Anything already in the cache is
+skipped, so a run that was stopped half way simply picks up where it left off.
+
+    python prewarm.py                     # images + welcome audio, 4 workers
+    python prewarm.py --workers 2 --no-audio
+    python prewarm.py --course "GCSE Biology" --dry-run
+
+Google credentials come from the GOOGLE_CREDENTIALS environment variable or
+.streamlit/secrets.toml, exactly like the app.
+"""
+import argparse
+import os
+import sys
+import time
+import tomllib
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from media_cache import (
+    IMAGE_BYTES_DISK, IMAGE_DISPLAY_WIDTH, TTS_CACHE, cached_image_entry, cached_image_url,
+    cached_speech, clean_text_for_speech, fetch_display_image, image_bytes_key, tts_cache_key,
+    welcome_message,
+)
+from sheets_quota import QUOTA, BACKGROUND, open_workbook
+from student_cache import parse_student_rows
+from syllabus import SYLLABUS_WORKSHEET, curriculum_from_records, likely_image_terms
+
+
+def load_credentials(secrets_path=".streamlit/secrets.toml"):
+    creds = os.environ.get("GOOGLE_CREDENTIALS")
+    if creds:
+        return creds
+    if os.path.exists(secrets_path):
+        with open(secrets_path, "rb") as f:
+            creds = tomllib.load(f).get("GOOGLE_CREDENTIALS")
+        if creds:
+            return creds
+    sys.exit("GOOGLE_CREDENTIALS not found in the environment or " + secrets_path)
+
+
+def build_jobs(curriculum, students, with_images=True, with_audio=True):
+    """Returns a de-duplicated list of (kind, payload) jobs."""
+    jobs = []
+    seen = set()
+
+    def add(kind, payload):
+        key = (kind, payload.lower())
+        if key not in seen:
+            seen.add(key)
+            jobs.append((kind, payload))
+
+    if with_images:
+        for course, topics in curriculum.items():
+            for topic in topics:
+                for term in likely_image_terms(topic):
+                    add("image", term)
+
+    if with_audio:
+        for name, record in students.items():
+            # The app only speaks the welcome when there is no history to resume
+            if record.get("history"):
+                continue
+            has_vault = bool(str(record.get("file_vault", "")).strip())
+            add("audio", clean_text_for_speech(welcome_message(name, has_vault=has_vault)))
+
+    return jobs
+
+
+def is_cached(kind, payload):
+    if kind == "image":
+        entry = cached_image_entry(payload)
+        if entry is None:
+            return False
+        return not entry.get("url") or IMAGE_BYTES_DISK.has(image_bytes_key(entry["url"], IMAGE_DISPLAY_WIDTH))
+    return TTS_CACHE.has(tts_cache_key(payload))
+
+
+def run_job(kind, payload, pause):
+    """Fills one cache entry. Returns "found", "none" (searched, nothing usable) or raises.
+    A search service outage raises too, so the term is retried on the next run."""
+    if kind == "image":
+        url = cached_image_url(payload)
+        # Download and resize too, so the first student to see it gets the cached bytes
+        data = fetch_display_image(url) if url else None
+        if url and not data:
+            # Dead link: search again past it so the cache doesn't keep pointing at it
+            url = cached_image_url(payload)
+            data = fetch_display_image(url) if url else None
+        result = "found" if data else "none"
+    else:
+        cached_speech(payload)
+        result = "found"
+    # Be polite to DuckDuckGo/Wikipedia/Google when running several workers
+    time.sleep(pause)
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pre-warm Christine's image and TTS caches from the syllabus.")
+    parser.add_argument("--workers", type=int, default=4, help="parallel lookups (default 4)")
+    parser.add_argument("--pause", type=float, default=0.5, help="seconds each worker waits between jobs")
+    parser.add_argument("--course", action="append", help="only this course (repeatable)")
+    parser.add_argument("--no-images", action="store_true", help="skip image search terms")
+    parser.add_argument("--no-audio", action="store_true", help="skip welcome phrase audio")
+    parser.add_argument("--dry-run", action="store_true", help="list pending jobs and exit")
+    args = parser.parse_args(argv)
+
+    workbook = open_workbook(load_credentials())
+    syllabus_sheet = QUOTA.call(workbook.worksheet, SYLLABUS_WORKSHEET, priority=BACKGROUND)
+    records = QUOTA.call(syllabus_sheet.get_all_records, priority=BACKGROUND)
+    curriculum = curriculum_from_records(records)
+    if args.course:
+        curriculum = {c: t for c, t in curriculum.items() if c in args.course}
+
+    students = {}
+    if not args.no_audio:
+        student_sheet = QUOTA.call(workbook.get_worksheet, 0, priority=BACKGROUND)
+        students = parse_student_rows(QUOTA.call(student_sheet.get_all_values, priority=BACKGROUND))
+
+    jobs = build_jobs(curriculum, students, with_images=not args.no_images, with_audio=not args.no_audio)
+    pending = [job for job in jobs if not is_cached(*job)]
+    print(f"📚 {len(curriculum)} courses, {sum(len(t) for t in curriculum.values())} topics, {len(students)} students.")
+    print(f"🧾 {len(jobs)} cache entries, {len(jobs) - len(pending)} already warm, {len(pending)} to fill.")
+
+    if args.dry_run:
+        for kind, payload in pending:
+            print(f"  [{kind}] {payload}")
+        return 0
+
+    counts = {"found": 0, "none": 0, "error": 0}
+    started = time.time()
+    with ThreadPoolExecutor(max_workers=max(1, args.workers)) as pool:
+        futures = {pool.submit(run_job, kind, payload, args.pause): (kind, payload) for kind, payload in pending}
+        for done, future in enumerate(as_completed(futures), 1):
+            kind, payload = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                result = "error"
+                print(f"  🛑 [{kind}] {payload[:60]}: {e}")
+            counts[result] += 1
+            icon = {"found": "✅", "none": "⚠️", "error": "🛑"}[result]
+            print(f"{icon} {done}/{len(pending)} [{kind}] {payload[:60]}")
+
+    print(f"Done in {time.time() - started:.0f}s: {counts['found']} filled, "
+          f"{counts['none']} with no image, {counts['error']} errors. Re-run to retry errors.")
+    return 1 if counts["error"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
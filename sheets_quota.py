@@ -0,0 +1,211 @@
+import json
+import random
+import threading
+import time
+
+# --- PROCESS-WIDE GOOGLE SHEETS QUOTA MANAGER ---
+# Every session shares one gspread client, and Google's quota (roughly 60 requests
+# per minute per user) is counted per service account, not per student. All Sheets
+# traffic goes through QUOTA.call() so a classroom logging in together queues up
+# politely instead of tripping 429s.
+
+INTERACTIVE = 0  # a student is waiting on the screen for this
+BACKGROUND = 1   # dossier timers, prefetches and other work nobody is staring at
+
+SHEETS_REQUESTS_PER_MINUTE = 55
+SHEETS_BURST = 10
+SHEETS_MAX_RETRIES = 5
+SHEETS_BASE_BACKOFF = 1.0
+SHEETS_MAX_BACKOFF = 32.0
+
+QUOTA_STATUS = 429
+RETRYABLE_STATUS = {QUOTA_STATUS, 500, 502, 503}
+
+
+def _status(e):
+    """HTTP status of a gspread/requests error (response.status_code) or a google.api_core one (code)."""
+    status = getattr(getattr(e, "response", None), "status_code", None)
+    if status is None:
+        status = getattr(e, "code", None)
+    return status if isinstance(status, int) else None
+
+
+def is_quota_error(e):
+    """True only for 429s: the request was rejected before it ran, so it is always safe to repeat."""
+    if _status(e) == QUOTA_STATUS:
+        return True
+    text = str(e)
+    return "RATE_LIMIT_EXCEEDED" in text or "Quota exceeded" in text
+
+
+def is_retryable_error(e):
+    """True for quota (429) and transient server errors from gspread/requests."""
+    return is_quota_error(e) or _status(e) in RETRYABLE_STATUS
+
+
+class _InFlight:
+    def __init__(self, priority):
+        self.priority = priority
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.followers = 0
+
+
+class SheetsQuotaManager:
+    def __init__(self, per_minute=SHEETS_REQUESTS_PER_MINUTE, burst=SHEETS_BURST,
+                 max_retries=SHEETS_MAX_RETRIES, base_backoff=SHEETS_BASE_BACKOFF,
+                 max_backoff=SHEETS_MAX_BACKOFF, label="Sheets"):
+        self.label = label
+        self.rate = per_minute / 60.0
+        self.burst = burst
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+
+        self._cond = threading.Condition()
+        self._tokens = float(burst)
+        self._last_refill = time.monotonic()
+        self._paused_until = 0.0
+        self._waiting = {INTERACTIVE: 0, BACKGROUND: 0}
+
+        self._inflight_lock = threading.Lock()
+        self._inflight = {}
+
+        self._counters = {"calls": 0, "coalesced": 0, "retries": 0, "throttled": 0, "failed": 0}
+
+    # --- TOKEN BUCKET ---
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+
+    def _acquire(self, priority, flight=None):
+        """Blocks until a token is free. Background callers always yield to waiting interactive ones.
+        A coalesced read is queued at its flight's priority, which a joining interactive caller can raise."""
+        with self._cond:
+            if flight is not None:
+                priority = flight.priority
+            self._waiting[priority] += 1
+            waited = False
+            try:
+                while True:
+                    if flight is not None and flight.priority != priority:
+                        self._waiting[priority] -= 1
+                        priority = flight.priority
+                        self._waiting[priority] += 1
+                    self._refill()
+                    now = time.monotonic()
+                    ahead = any(count for lane, count in self._waiting.items() if lane < priority)
+                    if now >= self._paused_until and self._tokens >= 1 and not ahead:
+                        self._tokens -= 1
+                        if waited:
+                            self._counters["throttled"] += 1
+                        return
+                    waited = True
+                    if now < self._paused_until:
+                        delay = self._paused_until - now
+                    else:
+                        delay = max((1 - self._tokens) / self.rate, 0.01)
+                    self._cond.wait(timeout=min(delay, 1.0))
+            finally:
+                self._waiting[priority] -= 1
+                self._cond.notify_all()
+
+    def _back_off(self, attempt):
+        """A 429 means the whole service account is over quota, so every caller pauses, not just this one."""
+        delay = min(self.max_backoff, self.base_backoff * (2 ** attempt)) + random.uniform(0, self.base_backoff)
+        with self._cond:
+            self._paused_until = max(self._paused_until, time.monotonic() + delay)
+            self._tokens = 0.0
+            self._counters["retries"] += 1
+        return delay
+
+    def _call_with_retries(self, func, args, kwargs, priority, flight=None, idempotent=True):
+        # A 5xx can arrive after Google already applied the write, so only safe requests retry on it
+        should_retry = is_retryable_error if idempotent else is_quota_error
+        attempt = 0
+        while True:
+            self._acquire(priority, flight)
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                if attempt >= self.max_retries or not should_retry(e):
+                    with self._cond:
+                        self._counters["failed"] += 1
+                    raise
+                delay = self._back_off(attempt)
+                print(f"{self.label} quota hit ({e}); backing off {delay:.1f}s (attempt {attempt + 1}).")
+                attempt += 1
+
+    # --- PUBLIC API ---
+    def call(self, func, *args, priority=INTERACTIVE, coalesce_key=None, idempotent=True, **kwargs):
+        """Runs one Sheets request under the shared quota.
+
+        Pass idempotent=False for writes that must not happen twice (appends, new
+        worksheets): they are retried on 429s only, never on server errors.
+
+        Reads that pass the same coalesce_key while an identical read is already in
+        flight wait for that read and share its result instead of spending quota,
+        and lift it to their own priority if that is higher. Shared results must be
+        treated as read-only.
+        """
+        with self._cond:
+            self._counters["calls"] += 1
+
+        if coalesce_key is None:
+            return self._call_with_retries(func, args, kwargs, priority, idempotent=idempotent)
+
+        with self._inflight_lock:
+            flight = self._inflight.get(coalesce_key)
+            leader = flight is None
+            if leader:
+                flight = _InFlight(priority)
+                self._inflight[coalesce_key] = flight
+            else:
+                flight.followers += 1
+
+        if not leader:
+            with self._cond:
+                self._counters["coalesced"] += 1
+                # A student waiting on a background read must not queue behind other students
+                if priority < flight.priority:
+                    flight.priority = priority
+                    self._cond.notify_all()
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = self._call_with_retries(func, args, kwargs, priority, flight)
+            return flight.result
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._inflight_lock:
+                self._inflight.pop(coalesce_key, None)
+            flight.done.set()
+
+    def stats(self):
+        with self._cond:
+            self._refill()
+            report = dict(self._counters)
+            report["tokens"] = round(self._tokens, 1)
+            report["waiting_interactive"] = self._waiting[INTERACTIVE]
+            report["waiting_background"] = self._waiting[BACKGROUND]
+            report["paused_s"] = round(max(0.0, self._paused_until - time.monotonic()), 1)
+        return report
+
+
+QUOTA = SheetsQuotaManager()
+
+WORKBOOK_NAME = "Christine Student Memory"
+
+
+def open_workbook(creds_json):
+    """Authorises the service account and opens the shared workbook under the quota."""
+    import gspread
+    gc = gspread.service_account_from_dict(json.loads(creds_json))
+    return QUOTA.call(gc.open, WORKBOOK_NAME)
@@ -0,0 +1,207 @@
+import copy
+import json
+import threading
+import time
+
+# --- SHARED IN-PROCESS STUDENT CACHE ---
+# One copy of every student profile for the whole Streamlit process, so tabs and
+# background timers stop reloading the entire sheet and overwriting each other.
+# Every record carries a version number. Writers say which version their edits
+# were based on (compare-and-swap), and only the fields they actually changed
+# are sent to Google Sheets.
+
+# Sheet columns B..F, in order. Column A is the student's name.
+STUDENT_FIELDS = ["summary", "history", "age", "last_topic", "file_vault"]
+HISTORY_ROWS_SAVED = 10
+CACHE_MAX_AGE = 600
+
+
+class StaleWriteError(Exception):
+    """Raised when another writer changed the same field since this writer's snapshot."""
+
+    def __init__(self, name, fields, latest, version):
+        super().__init__(f"Profile '{name}' changed elsewhere (fields: {', '.join(fields)}).")
+        self.name = name
+        self.fields = fields
+        self.latest = latest
+        self.version = version
+
+
+def parse_student_rows(rows):
+    """Turns a raw get_all_values() dump into {name: record}."""
+    db = {}
+    if len(rows) <= 1:
+        return db
+
+    for row in rows[1:]:
+        # Pad a copy: rows can be shared between coalesced readers
+        row = list(row) + [""] * (6 - len(row))
+
+        name_col = str(row[0]).strip().lower()
+        summary_col = str(row[1]).strip()
+        history_col = str(row[2]).strip()
+        age_col = str(row[3]).strip()
+        topic_col = str(row[4]).strip()
+        vault_col = str(row[5]).strip()
+
+        if name_col:
+            try:
+                hist = json.loads(history_col)
+            except:
+                hist = []
+
+            student_age = None if (age_col == "" or age_col == "0") else age_col
+
+            db[name_col] = {
+                "summary": summary_col,
+                "history": hist,
+                "age": student_age,
+                "last_topic": topic_col,
+                "file_vault": vault_col
+            }
+    return db
+
+
+def serialize_field(field, value):
+    """The exact cell text a field is stored as."""
+    if field == "history":
+        recent = (value or [])[-HISTORY_ROWS_SAVED:]
+        return json.dumps(recent)
+    if value is None:
+        return ""
+    return str(value)
+
+
+def merge_history(base, current, mine):
+    """Puts the messages this writer appended since base on the end of current.
+    Returns None if this writer did anything other than append (e.g. a reset)."""
+    base = base or []
+    mine = mine or []
+    if len(mine) < len(base) or mine[:len(base)] != base:
+        return None
+    return list(current or []) + mine[len(base):]
+
+
+def _sheet_view(record):
+    return {f: serialize_field(f, record.get(f)).strip() for f in STUDENT_FIELDS}
+
+
+class StudentCache:
+    def __init__(self, max_age=CACHE_MAX_AGE):
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._write_locks = {}
+        self._records = {}
+        self._loaded_at = 0.0
+        self._dossier_version = 0
+
+    # --- LOADING ---
+    def is_fresh(self):
+        return self._loaded_at > 0 and time.time() - self._loaded_at < self.max_age
+
+    def ensure_loaded(self, fetch_rows, force=False):
+        """Loads the sheet once per max_age for the whole process.
+
+        There is no lock around the fetch: concurrent callers are expected to share
+        one read through fetch_rows (the app coalesces it in the quota manager), so a
+        student who arrives during a background reload joins it at their own priority
+        instead of queueing behind it.
+        """
+        if not force and self.is_fresh():
+            return
+        started = time.time()
+        parsed = parse_student_rows(fetch_rows())
+        with self._lock:
+            for name, data in parsed.items():
+                entry = self._records.get(name)
+                if entry is None:
+                    self._records[name] = {"data": data, "version": 1, "written_at": 0.0}
+                    self._dossier_version += 1
+                elif entry["written_at"] < started and _sheet_view(entry["data"]) != _sheet_view(data):
+                    # Edited directly in the sheet (e.g. by a teacher) since we last looked
+                    if entry["data"].get("summary") != data.get("summary"):
+                        self._dossier_version += 1
+                    entry["data"] = data
+                    entry["version"] += 1
+            self._loaded_at = max(self._loaded_at, time.time())
+
+    # --- READING ---
+    def snapshot(self, name):
+        """Returns (private copy of the record, version). Unknown students are (None, 0)."""
+        with self._lock:
+            entry = self._records.get(name)
+            if entry is None:
+                return None, 0
+            return copy.deepcopy(entry["data"]), entry["version"]
+
+    def summaries(self):
+        """{name: dossier text} for every student, without copying histories or vaults."""
+        with self._lock:
+            return {name: entry["data"].get("summary", "") for name, entry in self._records.items()}
+
+    def dossier_version(self):
+        """Bumped whenever any student's summary (dossier) is added or changes. Chat-only saves don't move it."""
+        with self._lock:
+            return self._dossier_version
+
+    # --- WRITING ---
+    def _write_lock(self, name):
+        with self._lock:
+            if name not in self._write_locks:
+                self._write_locks[name] = threading.Lock()
+            return self._write_locks[name]
+
+    def commit(self, name, base, base_version, new_data, write_fields, append_row):
+        """Compare-and-swap save of one student.
+
+        base/base_version are the record and version the writer started from. Fields
+        that differ between base and new_data are this writer's changes. If someone
+        else saved in the meantime, changes to untouched fields are rebased on top and
+        messages appended to history go on the end of the other writer's history; any
+        other field both sides changed raises StaleWriteError and nothing is written.
+
+        write_fields(name, {field: cell_text}) and append_row(name, [cell_text, ...])
+        do the actual Sheets calls. Returns (new_version, fields changed by others).
+        """
+        base = base or {}
+        changes = {f: new_data.get(f) for f in STUDENT_FIELDS if new_data.get(f) != base.get(f)}
+
+        with self._write_lock(name):
+            current, current_version = self.snapshot(name)
+
+            others = {}
+            if current is not None and current_version != base_version:
+                conflicts = [f for f in changes if current.get(f) != base.get(f) and current.get(f) != changes[f]]
+                if "history" in conflicts:
+                    # Two tabs chatting at once both append; keep both sides' messages
+                    merged = merge_history(base.get("history"), current.get("history"), changes["history"])
+                    if merged is not None:
+                        conflicts.remove("history")
+                        changes["history"] = merged
+                        others["history"] = merged
+                if conflicts:
+                    raise StaleWriteError(name, conflicts, current, current_version)
+                others.update({f: current.get(f) for f in STUDENT_FIELDS
+                               if f not in changes and current.get(f) != base.get(f)})
+
+            if current is None:
+                data = {f: copy.deepcopy(new_data.get(f)) for f in STUDENT_FIELDS}
+                append_row(name, [serialize_field(f, data[f]) for f in STUDENT_FIELDS])
+            else:
+                changes = {f: v for f, v in changes.items() if current.get(f) != v}
+                if not changes:
+                    return current_version, others
+                write_fields(name, {f: serialize_field(f, v) for f, v in changes.items()})
+                data = current
+                data.update(copy.deepcopy(changes))
+
+            with self._lock:
+                entry = self._records.get(name)
+                version = (entry["version"] if entry else 0) + 1
+                self._records[name] = {"data": data, "version": version, "written_at": time.time()}
+                if entry is None or "summary" in changes:
+                    self._dossier_version += 1
+            return version, others
+
+
+STUDENTS = StudentCache()
@@ -0,0 +1,51 @@
+import re
+
+# --- SYLLABUS HELPERS ---
+# Shared by app.py and prewarm.py.
+
+SYLLABUS_WORKSHEET = "Syllabus"
+
+
+def curriculum_from_records(records):
+    """Turns Syllabus get_all_records() rows into {course: [topics]} in sheet order."""
+    curriculum = {}
+    for row in records:
+        course = str(row.get("Course", "")).strip()
+        topic = str(row.get("Topic", "")).strip()
+        if course and topic:
+            if course not in curriculum:
+                curriculum[course] = []
+            curriculum[course].append(topic)
+    return curriculum
+
+
+def likely_image_terms(topic, max_words=3):
+    """Guesses the [IMAGE_SEARCH] terms Christine will ask for on a topic.
+
+    The system prompt tells the model to use ultra-short nouns (1 to 3 words), so we
+    use the topic itself plus its parts split on common separators, e.g.
+    "Cells - Mitochondria & Ribosomes" -> ["Cells", "Mitochondria", "Ribosomes"].
+    """
+    cleaned = re.sub(r"\(.*?\)", "", topic).strip()
+    chunks = re.split(r"\s*[:;,/&–—]\s*|\s+-\s+", cleaned)
+    parts = []
+    for chunk in chunks:
+        # "Acids and Alkalis" is a fine search on its own, as are its halves
+        parts.append(chunk)
+        parts.extend(re.split(r"\s+(?:and|vs\.?)\s+", chunk))
+
+    terms = []
+    for part in parts:
+        words = part.split()
+        if not words or len(words) > max_words:
+            continue
+        term = " ".join(words)
+        if term.lower() not in [t.lower() for t in terms]:
+            terms.append(term)
+
+    if not terms:
+        # Long descriptive topics usually end on the noun phrase: "The causes of World War One"
+        words = re.sub(r"[:;,/&–—-]", " ", cleaned).split()
+        if words:
+            terms.append(" ".join(words[-max_words:]))
+    return terms